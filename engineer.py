@@ -22,16 +22,31 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import argparse
+import asyncio
+import contextlib
+import cProfile
+import functools
+import heapq
+import io
+import json
 import math
+import os
+import pickle
+import pstats
 import re
 import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from matplotlib.patches import Arc
-from scipy.interpolate import interp1d
+from scipy.interpolate import RBFInterpolator, interp1d
 from scipy.optimize import fsolve, curve_fit, minimize, minimize_scalar
+from scipy.stats import qmc
 
 '''plots format style'''''''''''''''''''''
 
@@ -60,6 +75,15 @@ plt.rcParams['figure.subplot.top'] = 0.975
 
 class Labyrinth():  # this is only one geometry
 
+    # Konstanten a, b, c, d der Cd-Gleichung nach Crookston & Tullis (2013) für den Keywinkel alpha
+    Angle_kons = np.array([[6, 0.009447, -4.039, 0.3955, 0.187],
+                           [8, 0.017090, -3.497, 0.4048, 0.2286],
+                           [10, 0.029900, -2.978, 0.4107, 0.2520],
+                           [12, 0.030390, -3.102, 0.4393, 0.2912],
+                           [15, 0.031600, -3.270, 0.4849, 0.3349],
+                           [20, 0.033610, -3.500, 0.5536, 0.3923],
+                           [35, 0.018550, -4.904, 0.6697, 0.5062]])
+
     def __init__(self, bottom_level=None, downstream_water_level=None, discharge=None, labyrinth_width=None,
                  labyrinth_height=None, labyrinth_length=None, labyrinth_key_angle=None, path='', show_errors=True,
                  show_geometry=False, show_results=False, D=0.3, t=0.3, skip_zero_check=False):  # instance attribute
@@ -154,13 +178,7 @@ class Labyrinth():  # this is only one geometry
     # Abrufen von Konstanten aus Alpha_result, Private method
     def __angle_result(self):
 
-        Angle_kons = np.array([[6, 0.009447, -4.039, 0.3955, 0.187],
-                               [8, 0.017090, -3.497, 0.4048, 0.2286],
-                               [10, 0.029900, -2.978, 0.4107, 0.2520],
-                               [12, 0.030390, -3.102, 0.4393, 0.2912],
-                               [15, 0.031600, -3.270, 0.4849, 0.3349],
-                               [20, 0.033610, -3.500, 0.5536, 0.3923],
-                               [35, 0.018550, -4.904, 0.6697, 0.5062]])
+        Angle_kons = self.Angle_kons
 
         # Berechnung der Winkelkonstanten
 
@@ -383,82 +401,687 @@ class Labyrinth():  # this is only one geometry
             plt.savefig('Labyrinth-Wehr_plot.pdf')
 
 
-# Berechnung einer hydraulisch optimalen Geometrie aus den baulichen Randbedingungen
-def optimize_labyrinth_geometry(labyrinth, sohleHoehe, UW, Q, labyrinthBreite, labyrinthHoehe, labyrinthLaengeMax, path,
-                                show_results=False, show_plot=False):
-    B_vector = np.arange(1, labyrinthLaengeMax + 0.1, 0.1)
-    Angle_vector = np.arange(6, 36, 1)
+# Eingabeprüfung für Batch-Eingaben wie Labyrinth/FlapGate.check_and_exit_on_input_errors, aber vektorisiert
+# und ohne sys.exit: Regeln (Name, Untergrenze, Obergrenze für den Betrag, nur Warnung). Fehler sind fehlende
+# bzw. nicht endliche Werte, Werte <= Untergrenze und Beträge > Obergrenze. Bei Sohlhöhe und Unterwasser ist ein
+# Wert <= 0 wie in den Klassen nur eine Warnung ("Achtung: ..."). Der Klappenwinkel darf anders als in FlapGate
+# auch 0 oder negativ sein (wie in upstream_water_level_batch), aber höchstens 90° betragen.
+_LABYRINTH_REGELN = [('SohleHoehe', 0, None, True), ('Unterwasser', 0, None, True), ('Abfluss', 0, None, False),
+                     ('Labyrinth Breite', 0, None, False), ('Labyrinth Hoehe', 0, None, False),
+                     ('Labyrinth Laenge', 0, None, False), ('Keywinkel', 0, None, False), ('D', 0, None, False),
+                     ('t', 0, None, False)]
+_FLAP_GATE_REGELN = [('SohleHoehe', 0, None, True), ('Unterwasser', 0, None, True), ('Abfluss', 0, None, False),
+                     ('Klappe Breite', 0, None, False), ('Klappe Hoehe', 0, None, False),
+                     ('Klappe Winkel', None, 90, False)]
+
+
+# Fehlercode je Zeile: Bit i für einen Fehler in Eingabe i der Regeln, Bit 16 + i für eine Warnung.
+# Rückgabe: dict mit 'gültig' (keine Fehler), 'code' (beide in der gebroadcasteten Form der Eingaben),
+# 'meldungen' (Liste je Zeile in der Reihenfolge von np.ravel, '' ohne Befund) und 'felder' (Namen der Bits).
+def _eingabe_pruefung(werte, regeln):
+    werte = np.broadcast_arrays(*(np.asarray(wert, dtype=float) for wert in werte))
+    code = np.zeros(werte[0].shape, dtype=np.int64)
+
+    with np.errstate(invalid='ignore'):
+        for bit, (wert, (name, untere, obere, warnung)) in enumerate(zip(werte, regeln)):
+            fehler = ~np.isfinite(wert)
+            if obere is not None:
+                fehler |= np.abs(wert) > obere
+            if untere is not None:
+                zu_klein = np.isfinite(wert) & (wert <= untere)
+                if warnung:
+                    code |= zu_klein.astype(np.int64) << (16 + bit)
+                else:
+                    fehler |= zu_klein
+            code |= fehler.astype(np.int64) << bit
+
+    meldungen = [''] * code.size
+    code_flach = code.ravel()
+    werte_flach = [wert.ravel() for wert in werte]
+    for zeile in np.flatnonzero(code_flach):
+        texte = []
+        for bit, (name, untere, obere, warnung) in enumerate(regeln):
+            wert = werte_flach[bit][zeile]
+            if not code_flach[zeile] & ((1 << bit) | (1 << (16 + bit))):
+                continue
+            if not np.isfinite(wert):
+                texte.append(f"{name} Wert fehlt oder ist keine Zahl.")
+            elif untere is not None and wert <= untere:
+                texte.append(f"Achtung: {name} Wert ist negative." if warnung else
+                             f"{name} Wert ist nicht plausibel (sollte größer als {untere} sein).")
+            else:
+                texte.append(f"{name} Wert sollte {obere} nicht überschreiten.")
+        meldungen[zeile] = ' '.join(texte)
 
-    # Erstellen von leeren 2d-Arrays zum Speichern von Geometrieergebnissen
+    fehler_bits = (1 << len(regeln)) - 1
+    return {'gültig': (code & fehler_bits) == 0, 'code': code, 'meldungen': meldungen,
+            'felder': [regel[0] for regel in regeln]}
 
-    w_result = np.empty([np.size(B_vector), np.size(Angle_vector)])
-    l_result = np.empty([np.size(B_vector), np.size(Angle_vector)])
-    N_result = np.empty([np.size(B_vector), np.size(Angle_vector)])
-    S_result = np.empty([np.size(B_vector), np.size(Angle_vector)])
-    L_result = np.empty([np.size(B_vector), np.size(Angle_vector)])
-    Hu_result = np.empty([np.size(B_vector), np.size(Angle_vector)])
-    Cd_result = np.empty([np.size(B_vector), np.size(Angle_vector)])
-    hd_result = np.empty([np.size(B_vector), np.size(Angle_vector)])
-    v_result = np.empty([np.size(B_vector), np.size(Angle_vector)])
 
-    for i, B in enumerate(B_vector):
+# Eingabeprüfung für labyrinth_batch (gleiche Argumente), siehe _eingabe_pruefung
+def validate_labyrinth_inputs(bottom_level, downstream_water_level, discharge, labyrinth_width, labyrinth_height,
+                              labyrinth_length, labyrinth_key_angle, D=0.3, t=0.3):
+    return _eingabe_pruefung((bottom_level, downstream_water_level, discharge, labyrinth_width, labyrinth_height,
+                              labyrinth_length, labyrinth_key_angle, D, t), _LABYRINTH_REGELN)
 
-        for j, alpha in enumerate(Angle_vector):  # float werte --- Table
 
-            Lab = labyrinth(sohleHoehe, UW, Q, labyrinthBreite, labyrinthHoehe, B, alpha)
-            Lab.update()
-            # Lab.plot_geometry()
-            w_result[i, j] = Lab.w
-            l_result[i, j] = Lab.l
-            N_result[i, j] = Lab.N
-            S_result[i, j] = Lab.S
-            L_result[i, j] = Lab.L
-            Cd_result[i, j] = Lab.Cd
-            Hu_result[i, j] = Lab.Hu
-            hd_result[i, j] = Lab.Cd
-            v_result[i, j] = Lab.v
-
-            # Speicherung des H_min-Wertes und seine Index
-
-    Hu_min = np.amin(Hu_result)
-    i, j = np.where(Hu_result == Hu_min)[0], np.where(Hu_result == Hu_min)[1]
-    i = i[0]
-    j = j[0]
-
-    Cd_best = Cd_result[i, j]
-    Hu_best = Hu_result[i, j]
-    hd_best = hd_result[i, j]
-    v_best = v_result[i, j]
-    Angle_best = Angle_vector[j]
-    B_best = B_vector[i]
-    w_best = w_result[i, j]
-    l_best = l_result[i, j]
-    N_best = N_result[i, j]
-    S_best = S_result[i, j]
-    L_best = L_result[i, j]
-
-    bestLab = labyrinth(sohleHoehe, UW, Q, labyrinthBreite, labyrinthHoehe, B_best, Angle_best, path)
+# Eingabeprüfung für flap_gate_batch (gleiche Argumente), siehe _eingabe_pruefung
+def validate_flap_gate_inputs(bottom_level, downstream_water_level, discharge, flap_gate_width, flap_gate_height,
+                              flap_gate_angle):
+    return _eingabe_pruefung((bottom_level, downstream_water_level, discharge, flap_gate_width, flap_gate_height,
+                              flap_gate_angle), _FLAP_GATE_REGELN)
+
+
+# Kompakte Ergebnisse der Batch-Funktionen (records=True): ein NumPy-Structured-Array mit einem Datensatz je
+# Berechnung statt vieler Objekte oder Listen. Mehrdimensionale Eingaben werden flach gemacht (Reihenfolge wie
+# np.ravel), Einträge, die selbst dicts sind (z.B. Gradienten), werden nicht übernommen. Gleitkommawerte erhalten
+# dtype, ganzzahlige und boolesche Felder (z.B. Fehlercode, gültig) behalten ihren Typ.
+# pd.DataFrame(records) wandelt bei Bedarf in eine Tabelle um.
+def result_records(ergebnis, dtype=np.float64):
+    felder = {name: np.asarray(wert) for name, wert in ergebnis.items() if not isinstance(wert, dict)}
+    shape = np.broadcast_shapes(*(wert.shape for wert in felder.values()))
+
+    records = np.empty(int(np.prod(shape)), dtype=[(name, wert.dtype if wert.dtype.kind in 'biu' else dtype)
+                                                   for name, wert in felder.items()])
+    for name, wert in felder.items():
+        records[name] = np.broadcast_to(wert, shape).ravel()
+
+    return records
+
+
+# Wehrgeometrie für beliebig viele Geometrien in einem Schritt (wie Labyrinth.geometrie)
+def labyrinth_geometry_batch(labyrinth_width, labyrinth_length, labyrinth_key_angle, D=0.3):
+    W, B, alpha, D = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (
+        labyrinth_width, labyrinth_length, labyrinth_key_angle, D)))
+
+    w = 2 * (D + B * np.tan(np.radians(alpha)))  # w = Breite der einzelnen Keys
+    l = B / np.cos(np.radians(alpha))  # Länge der einzelnen schrägen Seitenwände
+    N = np.floor(W / w)  # Anazahl der Keys
+    S = W - N * w  # S = Seitenlänge
+    L = S + 2 * N * (D + l)  # Länge des Labyrinthwehrs
+
+    return {'w': w, 'l': l, 'N': N, 'S': S, 'L': L}
+
+
+# Konstanten a, b, c, d der Cd-Gleichung für beliebig viele Keywinkel (wie Labyrinth.__angle_result)
+def labyrinth_angle_coefficients(labyrinth_key_angle):
+    alpha = np.asarray(labyrinth_key_angle, dtype=float)
+    Angle_kons = Labyrinth.Angle_kons
+
+    return tuple(np.interp(alpha, Angle_kons[:, 0], Angle_kons[:, k]) for k in range(1, 5))
+
+
+# Vorberechnete Größen einer Geometrie für labyrinth_upstream_water_level als Python-Floats:
+# Wandlänge L und Konstanten a, b, c, d (wie Labyrinth.geometrie und __angle_result)
+@functools.lru_cache(maxsize=1024)
+def _labyrinth_koeffizienten(labyrinth_width, labyrinth_length, labyrinth_key_angle, D):
+    w = 2 * (D + labyrinth_length * (math.tan(math.radians(labyrinth_key_angle))))
+    l = labyrinth_length / math.cos(math.radians(labyrinth_key_angle))
+    N = math.floor(labyrinth_width / w)
+    L = labyrinth_width - N * w + 2 * N * (D + l)
+
+    return (L,) + tuple(float(k) for k in labyrinth_angle_coefficients(labyrinth_key_angle))
+
+
+# Oberwasserstand des Labyrinth-Wehrs für einen einzelnen Abfluss und Unterwasserstand, gleiches Ergebnis wie
+# Labyrinth(...).yu, aber ohne Objekt, Eingabeprüfung und NumPy (z.B. für Regelkreise und Oberflächen).
+# Die Geometriegrößen werden je Geometrie zwischengespeichert. Die Eingaben werden nicht geprüft.
+def labyrinth_upstream_water_level(bottom_level, downstream_water_level, discharge, labyrinth_width,
+                                   labyrinth_height, labyrinth_length, labyrinth_key_angle, D=0.3, gravity=9.81,
+                                   max_iterations=1000):
+    L, a, b, c, d = _labyrinth_koeffizienten(labyrinth_width, labyrinth_length, labyrinth_key_angle, D)
+    Q, W, P = discharge, labyrinth_width, labyrinth_height
+    wurzel_2g = pow((2 * gravity), 0.5)
+
+    # cal_Q
+    Cd_alt = 0.1
+    for _ in range(max_iterations):
+        Hu = pow((1.5 * (Q / (Cd_alt * L * wurzel_2g))), (2 / 3))
+        Cd_neu = a * pow((Hu / P), (b * (pow((Hu / P), c)))) + d
+        Q_neu = (2 / 3) * Cd_neu * L * wurzel_2g * pow(Hu, 1.5)
+        if abs(Q_neu - Q) < 0.01:
+            break
+        Cd_alt = Cd_neu
+
+    # cal_hd und cal_ruckstauH
+    hd = (downstream_water_level - bottom_level) - P
+    if hd > 0:
+        vd = Q / (W * (hd + P))
+        Hd = hd + ((vd * vd) / (2 * gravity))
+        R = Hd / Hu if Hu != 0 else math.nan
+        if 0 <= R <= 1.53:
+            Hu = Hu * ((0.0332 * pow(R, 4)) + (0.2008 * pow(R, 2) + 1))
+        elif 1.53 < R <= 3.5:
+            Hu = Hu * ((0.9379 * R) + 0.2174)
+        else:
+            Hu = Hd
+
+    # cal_v
+    v_alt = 0.1
+    while True:
+        v_neu = Q / (W * (Hu - ((v_alt * v_alt) / (2 * gravity)) + P))
+        if v_alt - v_neu <= 0.000001:
+            break
+        v_alt = v_neu
+
+    hu = Hu - pow(v_neu, 2) / (2 * gravity)
+
+    return bottom_level + P + hu
+
+
+# Hydraulik des Labyrinth-Wehrs für beliebig viele Kombinationen aus Geometrie, Abfluss und Unterwasser.
+# Alle Eingaben werden gegeneinander gebroadcastet, die Ergebnisse entsprechen Labyrinth(...).update()
+# und werden als dict von Arrays mit den Attributnamen der Klasse zurückgegeben.
+# coefficient_factors: optionale Faktoren (..., 4) auf die Konstanten a, b, c, d (z.B. für Monte-Carlo)
+# gradient=True ergänzt die Ableitungen von Hu, hu und yu nach den Eingaben (siehe _labyrinth_gradient)
+# records=True gibt Eingaben und Ergebnisse als Structured-Array zurück (siehe result_records)
+# validate=True prüft die Eingaben (validate_labyrinth_inputs), ungültige Zeilen werden nicht berechnet (np.nan),
+# 'Fehlercode' und 'gültig' kommen zum Ergebnis dazu
+def labyrinth_batch(bottom_level, downstream_water_level, discharge, labyrinth_width, labyrinth_height,
+                    labyrinth_length, labyrinth_key_angle, D=0.3, t=0.3, coefficient_factors=None, gravity=9.81,
+                    max_iterations=1000, gradient=False, records=False, validate=False):
+    Sh, UW, Q, W, P, B, alpha, D, t = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (
+        bottom_level, downstream_water_level, discharge, labyrinth_width, labyrinth_height, labyrinth_length,
+        labyrinth_key_angle, D, t)))
+
+    if validate:
+        pruefung = validate_labyrinth_inputs(Sh, UW, Q, W, P, B, alpha, D, t)
+        Q = np.where(pruefung['gültig'], Q, np.nan)
+
+    ergebnis = labyrinth_geometry_batch(W, B, alpha, D)
+    L = ergebnis['L']
+
+    a, b, c, d = labyrinth_angle_coefficients(alpha)
+    faktoren = None
+    if coefficient_factors is not None:
+        faktoren = np.asarray(coefficient_factors, dtype=float)
+        a, b, c, d = (k * faktoren[..., i] for i, k in enumerate((a, b, c, d)))
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # Berechnung von Abfluss, Iteration wie in Labyrinth.cal_Q
+        Cd_alt = np.full(Q.shape, 0.1)
+        Cd = np.full(Q.shape, np.nan)
+        Hu = np.full(Q.shape, np.nan)
+        aktiv = np.ones(Q.shape, dtype=bool)
+
+        for _ in range(max_iterations):
+            Hu_alt = np.power((1.5 * (Q / (Cd_alt * L * np.power((2 * gravity), 0.5)))), (2 / 3))
+            Cd_neu = a * np.power((Hu_alt / P), (b * (np.power((Hu_alt / P), c)))) + d
+            Q_neu = (2 / 3) * Cd_neu * L * np.power((2 * gravity), 0.5) * np.power(Hu_alt, 1.5)
+
+            fertig = aktiv & (np.abs(Q_neu - Q) < 0.01)
+            Cd[fertig] = Cd_neu[fertig]
+            Hu[fertig] = Hu_alt[fertig]
+
+            aktiv &= ~fertig & np.isfinite(Q_neu)
+            if not aktiv.any():
+                break
+            Cd_alt = np.where(aktiv, Cd_neu, Cd_alt)
+
+        Hu_frei = Hu.copy()
+
+        # Rückstaueinfluss, wie Labyrinth.cal_hd und Labyrinth.cal_ruckstauH
+        hd = (UW - Sh) - P
+        vd = Q / (W * (hd + P))
+        Hd = hd + ((vd * vd) / (2 * gravity))
+
+        R = np.where(Hu != 0, Hd / Hu, np.nan)
+        H_rs = np.where((0 <= R) & (R <= 1.53), Hu * ((0.0332 * np.power(R, 4)) + (0.2008 * np.power(R, 2) + 1)),
+                        np.where((1.53 < R) & (R <= 3.5), Hu * ((0.9379 * R) + 0.2174), Hd))
+        Hu = np.where(hd > 0, H_rs, Hu)
+
+        # Berechnung der Geschwindigkeit, Iteration wie in Labyrinth.cal_v
+        v_alt = np.full(Q.shape, 0.1)
+        v = np.full(Q.shape, np.nan)
+        aktiv = np.isfinite(Hu)
+
+        for _ in range(max_iterations):
+            h = Hu - ((v_alt * v_alt) / (2 * gravity))
+            v_neu = Q / (W * (h + P))
+
+            fertig = aktiv & (v_alt - v_neu <= 0.000001)
+            v[fertig] = v_neu[fertig]
+
+            aktiv &= ~fertig & np.isfinite(v_neu)
+            if not aktiv.any():
+                break
+            v_alt = np.where(aktiv, v_neu, v_alt)
+
+        hu = Hu - np.power(v, 2) / (2 * gravity)
+        yu = Sh + P + hu
+
+    ergebnis.update({'a': a, 'b': b, 'c': c, 'd': d, 'Cd': Cd, 'Hu_frei': Hu_frei, 'Hu': Hu, 'hd': hd, 'vd': vd,
+                     'Hd': Hd, 'v': v, 'hu': hu, 'yu': yu})
+
+    if gradient:
+        ergebnis.update(_labyrinth_gradient(Sh, UW, Q, W, P, B, alpha, D, faktoren, ergebnis, gravity))
+
+    if validate:
+        ergebnis = {name: wert if isinstance(wert, dict) else np.where(pruefung['gültig'], wert, np.nan)
+                    for name, wert in ergebnis.items()}
+        ergebnis.update({'Fehlercode': pruefung['code'], 'gültig': pruefung['gültig']})
+
+    if records:
+        return result_records({'Sh': Sh, 'UW': UW, 'Q': Q, 'W': W, 'P': P, 'B': B, 'alpha': alpha, 'D': D, 't': t,
+                               **ergebnis})
+
+    return ergebnis
+
+
+# Ableitungen von Hu, hu und yu aus labyrinth_batch nach Sh, UW, Q, W, P, B, alpha [1/°] und D.
+# Die Iterationen in cal_Q und cal_v werden nicht differenziert, sondern ihre Lösung (Satz über implizite
+# Funktionen): F(Hu) = 2/3 Cd(Hu/P) L sqrt(2g) Hu^1.5 - Q = 0 bzw. v = Q / (W (hu + P)).
+# Die Anzahl der Keys N ist stückweise konstant und wird festgehalten (dL/dD = 0), a, b, c, d sind in alpha
+# stückweise linear (an den Stützstellen wird die Steigung des folgenden Abschnitts verwendet).
+# Rückgabe: {'dHu': {...}, 'dhu': {...}, 'dyu': {...}} mit den Parameternamen wie in surrogate_parameter
+# und 'Sh' für die Sohlhöhe.
+def _labyrinth_gradient(Sh, UW, Q, W, P, B, alpha, D, faktoren, ergebnis, gravity):
+    N, w, L, a, b, c, d = (ergebnis[name] for name in ('N', 'w', 'L', 'a', 'b', 'c', 'd'))
+    Hu_frei, Hu, hd, vd, Hd, v = (ergebnis[name] for name in ('Hu_frei', 'Hu', 'hd', 'vd', 'Hd', 'v'))
+    null = np.zeros(Q.shape)
+    namen = ('Sh', 'UW', 'Q', 'W', 'P', 'B', 'alpha', 'D')
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # Geometrie: L = W - N w + 2 N (D + l)
+        rad = np.radians(alpha)
+        dL = dict.fromkeys(namen, null)
+        dL['W'] = np.ones(Q.shape)
+        dL['B'] = 2 * N * (1 / np.cos(rad) - np.tan(rad))
+        dL['alpha'] = 2 * N * B * (np.tan(rad) / np.cos(rad) - 1 / np.cos(rad) ** 2) * math.pi / 180
+
+        # Steigungen der Konstanten a, b, c, d je Abschnitt der Tabelle
+        Angle_kons = Labyrinth.Angle_kons
+        abschnitt = np.clip(np.searchsorted(Angle_kons[:, 0], alpha, side='right') - 1, 0, len(Angle_kons) - 2)
+        innerhalb = (alpha >= Angle_kons[0, 0]) & (alpha < Angle_kons[-1, 0])
+        steigung = np.diff(Angle_kons[:, 1:], axis=0) / np.diff(Angle_kons[:, 0])[:, None]
+        dk = [np.where(innerhalb, steigung[abschnitt, i], 0) for i in range(4)]
+        if faktoren is not None:
+            dk = [dk[i] * faktoren[..., i] for i in range(4)]
+
+        # freie Überfallhöhe, implizit aus F(Hu_frei) = 0
+        x = Hu_frei / P
+        xe = np.power(x, b * np.power(x, c))
+        Cd = a * xe + d
+        dCd_dx = a * xe * b * np.power(x, c - 1) * (c * np.log(x) + 1)
+        dCd_dk = (xe, a * xe * np.power(x, c) * np.log(x), a * xe * b * np.power(x, c) * np.log(x) ** 2, 1)
+
+        G = (2 / 3) * L * math.sqrt(2 * gravity) * np.power(Hu_frei, 1.5)
+        dF_dHu = G * (dCd_dx / P + 1.5 * Cd / Hu_frei)
+
+        dF = {name: Cd * G / L * dL[name] for name in namen}
+        dF['Q'] = dF['Q'] - 1
+        dF['P'] = dF['P'] - G * dCd_dx * Hu_frei / P ** 2
+        dF['alpha'] = dF['alpha'] + G * sum(dCd_dk[i] * dk[i] for i in range(4))
+        dHu_frei = {name: -dF[name] / dF_dHu for name in namen}
+
+        # Rückstau: H(Hu_frei, Hd) wie in _ruckstau_H mit Hd = UW - Sh - P + vd^2 / 2g, vd = Q / (W (UW - Sh))
+        R = Hd / Hu_frei
+        dH_dHu = np.where(R <= 1.53, 1 - 0.2008 * R ** 2 - 0.0996 * R ** 4, np.where(R <= 3.5, 0.2174, 0))
+        dH_dHd = np.where(R <= 1.53, 0.4016 * R + 0.1328 * R ** 3, np.where(R <= 3.5, 0.9379, 1))
+        dvd = {'Sh': vd / (UW - Sh), 'UW': -vd / (UW - Sh), 'Q': vd / Q, 'W': -vd / W}
+        dHd = {name: vd * dvd.get(name, null) / gravity for name in namen}
+        dHd['UW'] = dHd['UW'] + 1
+        dHd['Sh'] = dHd['Sh'] - 1
+        dHd['P'] = dHd['P'] - 1
+
+        rs = hd > 0
+        dHu = {name: np.where(rs, dH_dHu * dHu_frei[name] + dH_dHd * dHd[name], dHu_frei[name]) for name in namen}
+
+        # Geschwindigkeit wie in Labyrinth.cal_v: v = Q / (W (Hu - 0.1^2/2g + P)) nach dem ersten Schritt,
+        # sonst der Fixpunkt v = Q / (W (Hu - v^2/2g + P))
+        K_erst = Hu - (0.1 * 0.1) / (2 * gravity) + P
+        erst = 0.1 - Q / (W * K_erst) <= 0.000001
+        K = np.where(erst, K_erst, Hu - v * v / (2 * gravity) + P)
+        nenner = np.where(erst, W * K, W * (K - v * v / gravity))
+
+        dhu, dyu = {}, {}
+        for name in namen:
+            dv = (-v * W * (dHu[name] + (name == 'P')) - v * K * (name == 'W') + (name == 'Q')) / nenner
+            dhu[name] = dHu[name] - v * dv / gravity
+            dyu[name] = dhu[name] + (name == 'Sh') + (name == 'P')
+
+    return {'dHu': dHu, 'dhu': dhu, 'dyu': dyu}
+
+
+# Überfallhöhe nach Rückstau (wie Labyrinth.cal_ruckstauH) aus der freien Überfallhöhe Hu und Hd
+def _ruckstau_H(Hu, Hd):
+    R = Hd / Hu
+    return np.where(R <= 1.53, Hu * ((0.0332 * np.power(R, 4)) + (0.2008 * np.power(R, 2) + 1)),
+                    np.where(R <= 3.5, Hu * ((0.9379 * R) + 0.2174), Hd))
+
+
+# Abfluss über das Labyrinth-Wehr bei vorgegebenem Oberwasserstand (Umkehrung von labyrinth_batch).
+# Iteration über Q: aus Q folgen die Geschwindigkeitshöhen im Ober- und Unterwasser, aus Hu und Hd die freie
+# Überfallhöhe (Umkehrung der Rückstauformel per Bisektion) und daraus mit der Cd-Gleichung das neue Q.
+# Die Geschwindigkeit wird wie in Labyrinth.cal_v bestimmt: die Iteration dort beginnt mit v = 0.1 und bricht
+# ab, sobald v nicht mehr fällt, d.h. für v >= 0.1 nach dem ersten Schritt.
+# Liegt der Oberwasserstand unter der Wehrkrone oder unter der Energiehöhe im Unterwasser, ist Q = 0.
+# Bei R = Hd / Hu > 3.5 hängt der Oberwasserstand nicht mehr von Q ab und um R = 1.53 ist die Rückstauformel
+# nicht monoton, dort ist die Umkehrung nicht eindeutig.
+def labyrinth_discharge_batch(bottom_level, downstream_water_level, upstream_water_level, labyrinth_width,
+                              labyrinth_height, labyrinth_length, labyrinth_key_angle, D=0.3, gravity=9.81,
+                              max_iterations=100):
+    Sh, UW, yu, W, P, B, alpha, D = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (
+        bottom_level, downstream_water_level, upstream_water_level, labyrinth_width, labyrinth_height,
+        labyrinth_length, labyrinth_key_angle, D)))
+    shape = Sh.shape
+    Sh, UW, yu, W, P, B, alpha, D = (x.ravel() for x in (Sh, UW, yu, W, P, B, alpha, D))
+
+    L = labyrinth_geometry_batch(W, B, alpha, D)['L']
+    a, b, c, d = labyrinth_angle_coefficients(alpha)
+
+    hu = np.maximum(yu - Sh - P, 0)
+    hd = (UW - Sh) - P
+    c_v = (0.1 * 0.1) / (2 * gravity)
+
+    def abfluss(Hu, m):
+        Cd = a[m] * np.power((Hu / P[m]), (b[m] * (np.power((Hu / P[m]), c[m])))) + d[m]
+        return np.nan_to_num((2 / 3) * Cd * L[m] * np.power((2 * gravity), 0.5) * np.power(Hu, 1.5))
+
+    Q = np.zeros(np.size(hu))
+    Hu = hu.copy()
+    aktiv = np.flatnonzero(hu > 0)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        Q[aktiv] = np.where(hd[aktiv] > 0, 0.0, abfluss(hu[aktiv], aktiv))
+
+        for _ in range(max_iterations):
+            m = aktiv
+            v_erst = Q[m] / (W[m] * (Hu[m] - c_v + P[m]))
+            v = np.where(0.1 - v_erst <= 0.000001, v_erst, Q[m] / (W[m] * (hu[m] + P[m])))
+            Hu[m] = hu[m] + ((v * v) / (2 * gravity))
+
+            # freie Überfallhöhe, _ruckstau_H(x, Hd) ist für x <= Hd / 3.5 gleich Hd, bei Hu <= Hd folgt x = 0
+            Hu_frei = Hu[m]
+            rs = hd[m] > 0
+            if rs.any():
+                n = m[rs]
+                vd = Q[n] / (W[n] * (hd[n] + P[n]))
+                Hd = hd[n] + ((vd * vd) / (2 * gravity))
+                Hu_frei = Hu_frei.copy()
+                Hu_frei[rs] = _bisektion(lambda x: _ruckstau_H(x, Hd) - Hu[n], np.zeros(np.size(n)), Hu[n],
+                                         iterations=60)
+
+            Q_neu = abfluss(Hu_frei, m)
+            fertig = np.abs(Q_neu - Q[m]) <= 1e-9 * np.maximum(Q_neu, 1)
+            Q[m] = Q_neu
+            aktiv = m[~fertig]
+            if not np.size(aktiv):
+                break
+
+    return Q.reshape(shape)
+
+
+# Zwischenstand langer Berechnungen (optimize_labyrinth_geometry, operational_model) in einer lokalen Datei.
+# kennung beschreibt die Eingaben; ein Zwischenstand mit anderer kennung wird nicht fortgesetzt (ValueError).
+# speichern schreibt höchstens alle interval Sekunden (atomar über eine temporäre Datei), nach einem
+# vollständigen Lauf wird die Datei mit entfernen gelöscht. Ohne path passiert nichts.
+class _Checkpoint():
+    def __init__(self, path, kennung, interval=60):
+        self.path = path
+        self.kennung = repr(kennung)
+        self.interval = interval
+        self.letzte = time.monotonic()
+
+    def laden(self):
+        if not self.path or not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as datei:
+            inhalt = pickle.load(datei)
+        if inhalt['kennung'] != self.kennung:
+            raise ValueError(f"Zwischenstand {self.path} passt nicht zu den Eingaben.")
+        return inhalt['zustand']
+
+    def speichern(self, zustand):
+        if not self.path or time.monotonic() - self.letzte < self.interval:
+            return
+        with open(self.path + '.tmp', 'wb') as datei:
+            pickle.dump({'kennung': self.kennung, 'zustand': zustand}, datei)
+        os.replace(self.path + '.tmp', self.path)
+        self.letzte = time.monotonic()
+
+    def entfernen(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# Berechnung einer hydraulisch optimalen Geometrie aus den baulichen Randbedingungen
+# Optional werden auch die Stirnwandbreite D (D_vector) und die Wandstärke t (t_vector) variiert.
+# t beeinflusst die Hydraulik nicht, sondern nur das Wandvolumen L * t * P, das mit max_wall_volume begrenzt
+# werden kann. Die Hydraulik wird daher nur je (B, alpha, D) berechnet und nur für Geometrien, bei denen
+# mindestens eine Wandstärke die Volumenbegrenzung einhält.
+# search='pruned' berechnet zuerst die Geometrie aller Kandidaten und die Hydraulik nur für Kandidaten,
+# die das bisher beste Ergebnis noch unterbieten können (siehe _labyrinth_pruned_search). Das Ergebnis ist
+# identisch mit search='exhaustive', nicht berechnete Kandidaten fehlen aber im Plot.
+# enforce_validity=True schließt Geometrien außerhalb des Gültigkeitsbereichs der Cd-Gleichung aus
+# (Grenzen wie in Labyrinth.check_for_error), dazu kommen optionale Randbedingungen min_key_width,
+# even_key_count und max_L_W. Geometrische Grenzen werden vor der Hydraulik geprüft, H/P danach.
+# Die Anzahl der ausgeschlossenen Kandidaten je Grenze steht in bestLab.optimization_stats.
+# Der Entwurfsraum wird blockweise (chunk_size) berechnet, behalten werden nur die top_k besten Geometrien
+# (bestLab.top_designs). Die Ergebnisse aller Geometrien (bestLab.grid) werden nur mit return_grid=True
+# oder show_plot=True gespeichert.
+# Q und UW können auch Vektoren sein (Abflussganglinie bzw. Abflussdauerlinie mit zugehörigem Unterwasser).
+# Ziel ist dann das mit weights gewichtete Mittel von Hu über alle Abflüsse (Standard: gleiche Gewichte,
+# Gewichte aus einer Abflusszeitreihe liefert duration_weights). chunk_size zählt Geometrie x Abfluss,
+# H/P muss bei enforce_validity für alle Abflüsse eingehalten werden. bestLab wird für den größten Abfluss
+# erstellt, die Ergebnisspalten in top_designs sind gewichtete Mittel.
+# checkpoint: Datei für den Zwischenstand (nur search='exhaustive'), nach jedem Block höchstens alle
+# checkpoint_interval Sekunden gespeichert. Ein abgebrochener Lauf mit denselben Eingaben setzt beim letzten
+# gespeicherten Block fort und liefert dasselbe Ergebnis wie ein Lauf ohne Unterbrechung.
+# shard=(index, anzahl): nur die Geometrien mit Index % anzahl == index werden berechnet (nur
+# search='exhaustive'). Es wird kein Labyrinth erstellt, Rückgabe ist (top_designs, optimization_stats) des
+# Teilbereichs, siehe optimize_labyrinth_shard und merge_labyrinth_shards.
+def optimize_labyrinth_geometry(labyrinth, sohleHoehe, UW, Q, labyrinthBreite, labyrinthHoehe, labyrinthLaengeMax, path,
+                                show_results=False, show_plot=False, D_vector=None, t_vector=None,
+                                max_wall_volume=None, chunk_size=100000, search='exhaustive', enforce_validity=False,
+                                min_key_width=None, even_key_count=False, max_L_W=None, top_k=1, return_grid=False,
+                                weights=None, checkpoint=None, checkpoint_interval=60, shard=None):
+    if search not in ('exhaustive', 'pruned'):
+        raise ValueError("search muss 'exhaustive' oder 'pruned' sein.")
+    if checkpoint and search != 'exhaustive':
+        raise ValueError("checkpoint ist nur mit search='exhaustive' möglich.")
+    if shard is not None and search != 'exhaustive':
+        raise ValueError("shard ist nur mit search='exhaustive' möglich.")
+
+    B_vector = np.arange(1, labyrinthLaengeMax + 0.1, 0.1)
+    Angle_vector = np.arange(6, 36, 1)
+    D_vector = np.atleast_1d(np.asarray(0.3 if D_vector is None else D_vector, dtype=float))
+    t_vector = np.atleast_1d(np.asarray(0.3 if t_vector is None else t_vector, dtype=float))
+
+    # Abflüsse und Gewichte des Optimierungsziels
+    Q_vector = np.atleast_1d(np.asarray(Q, dtype=float))
+    UW_vector = np.broadcast_to(np.asarray(UW, dtype=float), Q_vector.shape)
+    gewichte = np.ones(np.size(Q_vector)) if weights is None else np.asarray(weights, dtype=float)
+    gewichte = np.broadcast_to(gewichte / np.sum(gewichte), Q_vector.shape)
+
+    # Entwurfsraum (B, alpha, D), die Wandstärke wird je Geometrie gewählt
+    shape = (np.size(B_vector), np.size(Angle_vector), np.size(D_vector))
+    n = int(np.prod(shape))
+    chunk_size = max(1, chunk_size // np.size(Q_vector))
+
+    ausgeschlossen = {}
+    besten = []  # Heap der top_k besten Geometrien, Einträge (-Hu, -Index, Werte)
+
+    # Ergebnisse aller Geometrien nur auf Anforderung
+    raster = show_plot or return_grid
+    if raster:
+        grid = {name: np.full(n, np.nan) for name in ('w', 'l', 'N', 'S', 'L', 'Cd', 'Hu', 'hd', 'v')}
+
+    def geometrie(idx):
+        i, j, k = np.unravel_index(idx, shape)
+        geo = labyrinth_geometry_batch(labyrinthBreite, B_vector[i], Angle_vector[j], D_vector[k])
+
+        # kleinste zulässige Wandstärke je Geometrie, Geometrien ohne zulässige Wandstärke entfallen
+        if max_wall_volume is None:
+            t_ok = np.ones((np.size(idx), np.size(t_vector)), dtype=bool)
+        else:
+            t_ok = geo['L'][:, None] * t_vector[None, :] * labyrinthHoehe <= max_wall_volume
+
+        # Grenzen, die nur von der Geometrie abhängen
+        grenzen = {}
+        if max_wall_volume is not None:
+            grenzen['Wandvolumen'] = t_ok.any(axis=1)
+        if enforce_validity:
+            grenzen['w/P'] = geo['w'] / labyrinthHoehe < 4
+            grenzen['L/W'] = geo['L'] / labyrinthBreite < 7.6
+        if min_key_width is not None:
+            grenzen['Key Breite'] = geo['w'] >= min_key_width
+        if even_key_count:
+            grenzen['gerade Key Anzahl'] = (geo['N'] % 2 == 0) & (geo['N'] > 0)
+        if max_L_W is not None:
+            grenzen['max L/W'] = geo['L'] / labyrinthBreite <= max_L_W
+
+        ok = np.ones(np.size(idx), dtype=bool)
+        for name, maske in grenzen.items():
+            ausgeschlossen[name] = ausgeschlossen.get(name, 0) + int(np.sum(~maske))
+            ok &= maske
+
+        return geo, ok, np.argmax(t_ok, axis=1)
+
+    def hydraulik(idx, t_idx):
+        i, j, k = np.unravel_index(idx, shape)
+        Lab = labyrinth_batch(sohleHoehe, UW_vector, Q_vector, labyrinthBreite, labyrinthHoehe, B_vector[i, None],
+                              Angle_vector[j, None], D=D_vector[k, None])
+
+        # gewichtetes Mittel über die Abflüsse, bei einem Abfluss unverändert
+        mittel = {name: np.sum(Lab[name] * gewichte, axis=1) for name in ('Cd', 'Hu', 'hd', 'v', 'hu', 'yu')}
+        mittel.update({name: Lab[name][:, 0] for name in ('w', 'l', 'N', 'S', 'L')})
+        Hu = np.where(np.all(np.isfinite(Lab['Hu']), axis=1), mittel['Hu'], np.inf)
+
+        # Gültigkeitsbereich H/P der Cd-Gleichung, ungültige Geometrien werden nicht berücksichtigt
+        if enforce_validity:
+            HP_ok = np.all((0.05 < Lab['Hu'] / labyrinthHoehe) & (Lab['Hu'] / labyrinthHoehe < 1), axis=1)
+            ausgeschlossen['H/P'] = ausgeschlossen.get('H/P', 0) + int(np.sum(~HP_ok))
+            Hu = np.where(HP_ok, Hu, np.inf)
+
+        if raster:
+            for name in grid:
+                grid[name][idx] = mittel[name]
+            grid['Hu'][idx] = np.where(np.isfinite(Hu), Hu, np.nan)
+
+        # nur die top_k besten des Blocks kommen für den Heap in Frage
+        kandidaten = np.flatnonzero(np.isfinite(Hu))
+        kandidaten = kandidaten[np.lexsort((idx[kandidaten], Hu[kandidaten]))][:top_k]
+        for m in kandidaten:
+            eintrag = (-Hu[m], -idx[m])
+            if len(besten) == top_k and not eintrag > besten[0][:2]:
+                break
+            werte = {'Index': idx[m], 'B': B_vector[i[m]], 'alpha': Angle_vector[j[m]], 'D': D_vector[k[m]],
+                     't': t_vector[t_idx[m]]}
+            werte.update({name: mittel[name][m] for name in ('w', 'l', 'N', 'S', 'L', 'Cd', 'Hu', 'hd', 'v', 'hu', 'yu')})
+            if len(besten) < top_k:
+                heapq.heappush(besten, eintrag + (werte,))
+            else:
+                heapq.heapreplace(besten, eintrag + (werte,))
+
+        return Lab
+
+    # Schwelle, die ein Kandidat unterbieten muss um in die top_k zu kommen
+    def schwelle():
+        return -besten[0][0] if len(besten) == top_k else np.inf
+
+    stats = {'Kandidaten': n * np.size(t_vector), 'Geometrien': n}
+    n_zulaessig = 0
+
+    if search == 'exhaustive':
+        sicherung = _Checkpoint(checkpoint, ('optimize_labyrinth_geometry', sohleHoehe, labyrinthBreite, labyrinthHoehe,
+                                             labyrinthLaengeMax, Q_vector.tolist(), UW_vector.tolist(),
+                                             gewichte.tolist(), D_vector.tolist(), t_vector.tolist(),
+                                             max_wall_volume, chunk_size, enforce_validity, min_key_width,
+                                             even_key_count, max_L_W, top_k, raster, shard), checkpoint_interval)
+        zustand = sicherung.laden()
+        anfang, n_hydraulik = 0, 0
+        if zustand is not None:
+            anfang, n_hydraulik, n_zulaessig, besten = (zustand[name] for name in
+                                                        ('anfang', 'n_hydraulik', 'n_zulaessig', 'besten'))
+            ausgeschlossen.update(zustand['ausgeschlossen'])
+            if raster:
+                grid = zustand['grid']
+
+        for start in range(anfang, n, chunk_size):
+            idx = np.arange(start, min(start + chunk_size, n))
+            if shard is not None:
+                # jede shard[1]-te Geometrie, unabhängig von chunk_size (die Blöcke begrenzen nur den Speicher)
+                idx = idx[idx % shard[1] == shard[0]]
+            geo, ok, t_idx = geometrie(idx)
+            n_zulaessig += int(np.sum(ok))
+            if ok.any():
+                hydraulik(idx[ok], t_idx[ok])
+                n_hydraulik += int(np.sum(ok))
+            sicherung.speichern({'anfang': start + chunk_size, 'n_hydraulik': n_hydraulik, 'n_zulaessig': n_zulaessig,
+                                 'besten': besten, 'ausgeschlossen': ausgeschlossen,
+                                 'grid': grid if raster else None})
+        stats['hydraulisch berechnet'] = n_hydraulik
+        sicherung.entfernen()
+
+        if shard is not None:
+            eigene = np.arange(n) % shard[1] == shard[0]
+            stats.update({'Kandidaten': int(np.sum(eigene)) * np.size(t_vector), 'Geometrien': int(np.sum(eigene))})
+
+    else:
+        # Index der zulässigen Geometrien: Keywinkel, Wandlänge und Wandstärke
+        idx, L, t_idx = [], [], []
+        for start in range(0, n, chunk_size):
+            block = np.arange(start, min(start + chunk_size, n))
+            geo, ok, t_block = geometrie(block)
+            idx.append(block[ok])
+            L.append(geo['L'][ok])
+            t_idx.append(t_block[ok])
+        idx, L, t_idx = np.concatenate(idx), np.concatenate(L), np.concatenate(t_idx)
+        n_zulaessig = np.size(idx)
+
+        gruppe = np.unravel_index(idx, shape)[1]  # gleiche Konstanten a, b, c, d je Keywinkel
+        stats.update(_labyrinth_pruned_search(idx, gruppe, L, t_idx, hydraulik, schwelle, Q_vector, gewichte,
+                                              chunk_size))
+
+    stats['ausgeschlossen'] = ausgeschlossen
+    stats['geometrisch zulässig'] = n_zulaessig
+
+    if not besten and shard is None:
+        print('Keine zulässige Geometrie gefunden.')
+        return None
+
+    besten = [eintrag[2] for eintrag in sorted(besten, reverse=True)]
+    for werte in besten:
+        werte['L/W'] = werte['L'] / labyrinthBreite
+    top_designs = pd.DataFrame(besten, columns=['Index', 'B', 'alpha', 'D', 't', 'w', 'l', 'N', 'S', 'L', 'Cd', 'Hu',
+                                                'hd', 'v', 'hu', 'yu', 'L/W'])
+
+    if shard is not None:
+        return top_designs, stats
+    best = besten[0]
+
+    bemessung = np.argmax(Q_vector)
+    bestLab = labyrinth(sohleHoehe, UW_vector[bemessung], Q_vector[bemessung], labyrinthBreite, labyrinthHoehe,
+                        best['B'], best['alpha'], path, D=best['D'], t=best['t'])
+    bestLab.optimization_stats = stats
+    bestLab.top_designs = top_designs
+    if return_grid:
+        bestLab.grid = {name: werte.reshape(shape) for name, werte in grid.items()}
+        bestLab.grid.update({'B': B_vector, 'alpha': Angle_vector, 'D': D_vector})
 
     if show_results:
         print('Optimale Geometrie des Wehre ist:', '\n',
-              'Labyrinth Laenge = %2.2f [m]' % B_best, '\n',
-              'Key Frontwand =', Lab.D, '[m]', '\n',
-              'Key Winkel =', Angle_best, '[°]', '\n',
-              'Key Wandstaerke =', Lab.t, ' [m]', '\n',
-              'Labyrinth Hoehe = %2.2f [m]' % Lab.P, '\n',
-              'Keys Anzahl = %2.0f [m]' % N_best, '\n',
-              'Key Breite = %2.2f [m]' % w_best, '\n',
-              'Keys Breite = %2.2f [m]' % (N_best * w_best), '\n',
-              'Seite Breite[S] = %2.2f [m]' % S_best, '\n',
+              'Labyrinth Laenge = %2.2f [m]' % best['B'], '\n',
+              'Key Frontwand =', bestLab.D, '[m]', '\n',
+              'Key Winkel =', best['alpha'], '[°]', '\n',
+              'Key Wandstaerke =', bestLab.t, ' [m]', '\n',
+              'Labyrinth Hoehe = %2.2f [m]' % bestLab.P, '\n',
+              'Keys Anzahl = %2.0f [m]' % best['N'], '\n',
+              'Key Breite = %2.2f [m]' % best['w'], '\n',
+              'Keys Breite = %2.2f [m]' % (best['N'] * best['w']), '\n',
+              'Seite Breite[S] = %2.2f [m]' % best['S'], '\n',
               'Labyrinth Breite = %2.2f [m]' % labyrinthBreite, '\n',
-              'L/W = %2.2f [m]' % (L_best / labyrinthBreite), '\n',
-              'Hu_min = %2.2f [m]' % Hu_best, '\n',
+              'L/W = %2.2f [m]' % best['L/W'], '\n',
+              'Hu_min = %2.2f [m]' % best['Hu'], '\n',
               )
 
     if show_plot:
         plt.figure()
         alphai, Bi = np.meshgrid(Angle_vector, B_vector)
-        plt.pcolormesh(alphai, Bi, Hu_result, cmap='rainbow')  # imshow,pcolor options
+        # bei mehreren Stirnwandbreiten wird das Minimum über D dargestellt
+        Hu_plot = np.nanmin(grid['Hu'].reshape(shape), axis=2)
+        plt.pcolormesh(alphai, Bi, Hu_plot, cmap='rainbow')  # imshow,pcolor options
         plt.xlabel('alpha [°]')
         plt.ylabel('B [m]')
         plt.grid()
@@ -469,8 +1092,333 @@ def optimize_labyrinth_geometry(labyrinth, sohleHoehe, UW, Q, labyrinthBreite, l
     return bestLab
 
 
+# Aufteilung großer Geometriesuchen auf mehrere unabhängige Prozesse oder Rechner (ohne gemeinsame Dienste).
+# sites: Liste von dicts mit den Argumenten von optimize_labyrinth_geometry je Standort (sohleHoehe, UW, Q,
+# labyrinthBreite, labyrinthHoehe, labyrinthLaengeMax, optional D_vector, t_vector, weights, enforce_validity, ...).
+# Jede Geometrie jedes Standorts gehört genau einem Shard: Geometrie i von Standort s gehört zu
+# Shard (i + s) % shard_count, die Shards sind damit unabhängig von chunk_size gleich groß. Die top_k besten
+# Geometrien je Standort und die Statistik des Shards werden kompakt als npz nach output geschrieben (auch leere
+# Ergebnisse mit festen Spaltentypen), merge_labyrinth_shards fasst die Dateien aller Shards zusammen.
+def optimize_labyrinth_shard(sites, shard_index, shard_count, output, top_k=10, chunk_size=100000):
+    if not 0 <= shard_index < shard_count:
+        raise ValueError("shard_index muss zwischen 0 und shard_count - 1 liegen.")
+
+    tabellen, stats = [], []
+    for s, site in enumerate(sites):
+        top_designs, site_stats = optimize_labyrinth_geometry(None, path='', top_k=top_k, chunk_size=chunk_size,
+                                                              shard=((shard_index - s) % shard_count, shard_count),
+                                                              **site)
+        tabellen.append(top_designs.drop(columns='L/W').assign(Standort=s))
+        stats.append(site_stats)
+
+    tabelle = pd.concat(tabellen, ignore_index=True)
+    np.savez_compressed(output, shard=np.array([shard_index, shard_count]), sites=repr(sites),
+                        einstellungen=np.array([top_k, chunk_size]), stats=json.dumps(stats),
+                        **{name: tabelle[name].to_numpy(dtype=np.int64 if name in ('Index', 'alpha', 'Standort')
+                                                        else float) for name in tabelle.columns})
+
+
+# Zusammenfassen der Dateien von optimize_labyrinth_shard: je Standort die top_k besten Geometrien über alle
+# Shards (Reihenfolge wie in optimize_labyrinth_geometry: Hu, bei Gleichstand Index) und die summierte
+# Statistik. Das Ergebnis ist identisch mit optimize_labyrinth_geometry über den ganzen Entwurfsraum.
+# Fehlende oder doppelte Shards, Dateien eines anderen Sweeps oder mit anderen Einstellungen (top_k, chunk_size)
+# ergeben einen ValueError.
+# Rückgabe: Liste mit einem Labyrinth je Standort (None ohne zulässige Geometrie) mit top_designs und
+# optimization_stats wie bei optimize_labyrinth_geometry.
+def merge_labyrinth_shards(files, sites, labyrinth, path='', top_k=None):
+    if not files:
+        raise ValueError("Keine Shard-Dateien angegeben.")
+
+    tabellen, stats, shards, einstellungen = [], [], [], set()
+    for file in files:
+        with np.load(file) as daten:
+            if str(daten['sites']) != repr(sites):
+                raise ValueError(f"{file} gehört zu anderen Standorten.")
+            shards.append(tuple(int(x) for x in daten['shard']))
+            einstellungen.add(tuple(int(x) for x in daten['einstellungen']))
+            stats.append(json.loads(str(daten['stats'])))
+            spalten = [name for name in daten.files if name not in ('shard', 'sites', 'einstellungen', 'stats')]
+            tabellen.append(pd.DataFrame({name: daten[name] for name in spalten}))
+
+    shard_count = shards[0][1]
+    if sorted(shards) != [(i, shard_count) for i in range(shard_count)]:
+        raise ValueError(f"Unvollständige oder doppelte Shards: {sorted(shards)}")
+    if len(einstellungen) > 1:
+        raise ValueError(f"Shards mit unterschiedlichen Einstellungen (top_k, chunk_size): {sorted(einstellungen)}")
+    top_k = einstellungen.pop()[0] if top_k is None else top_k
+
+    tabelle = pd.concat(tabellen, ignore_index=True)
+
+    ergebnis = []
+    for s, site in enumerate(sites):
+        site_stats = {}
+        for shard_stats in stats:
+            for name, wert in shard_stats[s].items():
+                if isinstance(wert, dict):
+                    summe = site_stats.setdefault(name, {})
+                    for grenze, anzahl in wert.items():
+                        summe[grenze] = summe.get(grenze, 0) + anzahl
+                else:
+                    site_stats[name] = site_stats.get(name, 0) + wert
+
+        top_designs = tabelle[tabelle['Standort'] == s].drop(columns='Standort')
+        top_designs = top_designs.sort_values(['Hu', 'Index'], kind='stable').head(top_k).reset_index(drop=True)
+        if top_designs.empty:
+            print('Keine zulässige Geometrie gefunden.')
+            ergebnis.append(None)
+            continue
+        top_designs['L/W'] = top_designs['L'] / site['labyrinthBreite']
+        best = top_designs.iloc[0]
+
+        Q_vector = np.atleast_1d(np.asarray(site['Q'], dtype=float))
+        UW_vector = np.broadcast_to(np.asarray(site['UW'], dtype=float), Q_vector.shape)
+        bemessung = np.argmax(Q_vector)
+        bestLab = labyrinth(site['sohleHoehe'], UW_vector[bemessung], Q_vector[bemessung], site['labyrinthBreite'],
+                            site['labyrinthHoehe'], best['B'], best['alpha'], path, D=best['D'], t=best['t'])
+        bestLab.optimization_stats = site_stats
+        bestLab.top_designs = top_designs
+        ergebnis.append(bestLab)
+
+    return ergebnis
+
+
+# Gewichte für optimize_labyrinth_geometry aus einer Abflusszeitreihe (Abflussdauerlinie):
+# Zeitanteil, in dem der Abfluss dem jeweiligen Wert aus Q_vector am nächsten liegt
+def duration_weights(Q_vector, discharge_series):
+    Q_vector = np.asarray(Q_vector, dtype=float)
+    discharge_series = np.asarray(discharge_series, dtype=float)
+    discharge_series = discharge_series[np.isfinite(discharge_series)]
+
+    reihenfolge = np.argsort(Q_vector)
+    Q_sortiert = Q_vector[reihenfolge]
+    grenzen = 0.5 * (Q_sortiert[1:] + Q_sortiert[:-1])
+
+    anteil = np.bincount(np.searchsorted(grenzen, discharge_series), minlength=np.size(Q_vector))
+    gewichte = np.empty(np.size(Q_vector))
+    gewichte[reihenfolge] = anteil / np.size(discharge_series)
+
+    return gewichte
+
+
+# Untere Schranke der Überfallhöhe nach Rückstau (Labyrinth.cal_ruckstauH) für alle freien Überfallhöhen >= x0.
+# Die Rückstauformel ist in Hu nicht monoton, das Minimum liegt bei x0, an den Bereichsgrenzen R = 3.5 und
+# R = 1.53 oder am Minimum von Hu * (0.0332 R^4 + 0.2008 R^2 + 1) bei R^2 = u.
+def _ruckstau_untere_schranke(x0, hd, Hd):
+    x0, hd, Hd = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (x0, hd, Hd)))
+
+    def H(x):
+        return _ruckstau_H(x, Hd)
+
+    u = (-0.2008 + math.sqrt(0.2008 ** 2 + 4 * 0.0332 * 3 * 1.0)) / (2 * 0.0332 * 3)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        schranke = H(x0)
+        for x in (Hd / 3.5, Hd / 1.53, Hd / math.sqrt(u)):
+            schranke = np.where(x >= x0, np.minimum(schranke, H(x)), schranke)
+
+    return np.where(hd > 0, schranke, x0)
+
+
+# Suche mit Vorauswahl über die Geometrie für optimize_labyrinth_geometry.
+# Bei gleichem Keywinkel (gleiche Konstanten a, b, c, d), gleichem Q und P hängt die freie Überfallhöhe
+# nur von der Wandlänge L bzw. L/W ab: Q = L * F(Hu) mit monoton steigendem F, Hu fällt also mit L.
+# Bei mehreren Abflüssen gilt das je Abfluss, die Schranke des Ziels ist das gewichtete Mittel der Schranken.
+# Die Kandidaten jeder Gruppe werden nach fallendem L (bei gleichem L nach Index) berechnet. Die zuletzt
+# berechnete freie Überfallhöhe ist eine untere Schranke für alle folgenden Kandidaten der Gruppe, korrigiert
+# um die Abbruchgenauigkeit der Iteration in cal_Q (|Q_neu - Q| < 0.01): die Elastizität d ln F / d ln Hu
+# ist für alle Keywinkel >= 0.78, es wird 0.75 angesetzt. Sobald die Schranke (nach Rückstau) über dem bisher
+# besten Ergebnis liegt, wird der Rest der Gruppe verworfen.
+def _labyrinth_pruned_search(idx, gruppe, L, t_idx, hydraulik, schwelle, Q, gewichte, chunk_size):
+    reihenfolge = np.lexsort((idx, -L, gruppe))
+    idx, gruppe, t_idx = idx[reihenfolge], gruppe[reihenfolge], t_idx[reihenfolge]
+
+    gruppen, anfang = np.unique(gruppe, return_index=True)
+    ende = np.append(anfang[1:], np.size(idx))
+    position = anfang.copy()
+    aktiv = np.ones(np.size(gruppen), dtype=bool)
+
+    faktor = np.power(np.maximum(Q - 0.01, 0) / (Q + 0.01), 1 / 0.75)
+
+    schritt = 1
+    runden = 0
+    n_hydraulik = 0
+
+    while aktiv.any():
+        runden += 1
+        auswahl = [np.arange(position[g], min(position[g] + schritt, ende[g])) for g in np.flatnonzero(aktiv)]
+        auswahl = np.concatenate(auswahl)
+
+        Hu_frei = np.empty((np.size(auswahl), np.size(Q)))
+        for start in range(0, np.size(auswahl), chunk_size):
+            block = auswahl[start:start + chunk_size]
+            Lab = hydraulik(idx[block], t_idx[block])
+            Hu_frei[start:start + chunk_size] = Lab['Hu_frei']
+            hd, Hd = Lab['hd'][0], Lab['Hd'][0]
+        n_hydraulik += np.size(auswahl)
+
+        position[aktiv] = np.minimum(position[aktiv] + schritt, ende[aktiv])
+
+        # Schranke aus dem zuletzt berechneten (kürzesten) Kandidaten jeder Gruppe
+        letzter = np.cumsum([np.size(a) for a in np.split(auswahl, np.flatnonzero(np.diff(gruppe[auswahl])) + 1)]) - 1
+        Hu_frei = Hu_frei[letzter]
+        schranke = np.sum(_ruckstau_untere_schranke(Hu_frei * faktor, hd, Hd) * gewichte, axis=1)
+        schranke = np.where(np.all(np.isfinite(Hu_frei), axis=1), schranke, -np.inf)
+
+        aktiv[aktiv] = (position[aktiv] < ende[aktiv]) & ~(schranke > schwelle())
+        schritt *= 2
+
+    return {'hydraulisch berechnet': n_hydraulik, 'verworfen': np.size(idx) - n_hydraulik, 'Runden': runden}
+
+
+# Nicht dominierte Punkte (Pareto-Front) einer Menge von Zielwerten (n, m), alle Ziele werden minimiert.
+# Für zwei Ziele per Sortierung in O(n log n), sonst blockweiser Dominanzvergleich der (lexikographisch
+# sortierten) Punkte mit der bisherigen Front. chunk_size: maximale Anzahl verglichener Punktpaare je Block,
+# der Speicherbedarf liegt damit in der Größenordnung von chunk_size * m Byte.
+def pareto_front(objectives, chunk_size=2 ** 22):
+    F = np.asarray(objectives, dtype=float)
+    front = np.zeros(len(F), dtype=bool)
+    gueltig = np.all(np.isfinite(F), axis=1)
+    if not gueltig.any():
+        return front
+
+    # Doppelte Punkte werden zusammengefasst und erhalten dasselbe Ergebnis
+    F_unique, inverse = np.unique(F[gueltig], axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    if F_unique.shape[1] == 2:
+        # np.unique sortiert nach Ziel 1, dann Ziel 2: ein Punkt ist nicht dominiert,
+        # wenn sein Ziel 2 kleiner ist als bei allen Punkten davor
+        vorher_min = np.concatenate(([np.inf], np.minimum.accumulate(F_unique[:-1, 1])))
+        front_unique = F_unique[:, 1] < vorher_min
+    else:
+        # ein dominierender Punkt ist lexikographisch kleiner, steht also davor: verglichen wird ein Block mit der
+        # Front der Punkte davor, die übrigen Punkte des Blocks dann noch untereinander
+        def dominiert(block, kandidaten):
+            return (np.all(kandidaten[None, :, :] <= block[:, None, :], axis=2)
+                    & np.any(kandidaten[None, :, :] < block[:, None, :], axis=2)).any(axis=1)
+
+        front_unique = np.zeros(len(F_unique), dtype=bool)
+        front_vorher = F_unique[:0]
+        start = 0
+        while start < len(F_unique):
+            groesse = max(1, min(chunk_size // max(len(front_vorher), 1), math.isqrt(chunk_size)))
+            index = np.arange(start, min(start + groesse, len(F_unique)))
+            index = index[~dominiert(F_unique[index], front_vorher)]
+            index = index[~dominiert(F_unique[index], F_unique[index])]
+            front_unique[index] = True
+            front_vorher = np.concatenate((front_vorher, F_unique[index]))
+            start += groesse
+
+    front[gueltig] = front_unique[inverse]
+
+    return front
+
+
+# Mehrkriterielle Optimierung: Pareto-Front aus Überfallhöhe Hu und Wandlänge L über den Entwurfsraum aus
+# B_vector, Angle_vector und D_vector. Das Wandvolumen L * t * P wird mit ausgegeben, ist als Ziel aber nicht
+# eigenständig (die Wandstärke geht nicht in die Hydraulik ein, die Front wäre dieselbe wie für L).
+# Rückgabe: DataFrame mit allen nicht dominierten Geometrien, sortiert nach Hu.
+def pareto_labyrinth_geometry(sohleHoehe, UW, Q, labyrinthBreite, labyrinthHoehe, labyrinthLaengeMax, D=0.3, t=0.3,
+                              B_vector=None, Angle_vector=None, D_vector=None, chunk_size=100000, show_plot=False):
+    B_vector = np.arange(1, labyrinthLaengeMax + 0.1, 0.1) if B_vector is None else np.asarray(B_vector, dtype=float)
+    Angle_vector = np.arange(6, 36, 1) if Angle_vector is None else np.asarray(Angle_vector, dtype=float)
+    D_vector = np.atleast_1d(D if D_vector is None else np.asarray(D_vector, dtype=float))
+
+    shape = (np.size(B_vector), np.size(Angle_vector), np.size(D_vector))
+    n = int(np.prod(shape))
+    spalten = ['w', 'l', 'N', 'S', 'L', 'Cd', 'Hu', 'hu', 'yu']
+    werte = {name: np.empty(n) for name in spalten}
+
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        i, j, k = np.unravel_index(np.arange(start, stop), shape)
+        Lab = labyrinth_batch(sohleHoehe, UW, Q, labyrinthBreite, labyrinthHoehe, B_vector[i], Angle_vector[j],
+                              D=D_vector[k], t=t)
+        for name in spalten:
+            werte[name][start:stop] = Lab[name]
+
+    i, j, k = np.unravel_index(np.arange(n), shape)
+    designs = pd.DataFrame({'B': B_vector[i], 'alpha': Angle_vector[j], 'D': D_vector[k], 't': t, **werte})
+    designs['L/W'] = designs['L'] / labyrinthBreite
+    designs['Volumen'] = designs['L'] * t * labyrinthHoehe
+
+    front = pareto_front(np.column_stack((designs['Hu'].to_numpy(), designs['L'].to_numpy())))
+    pareto = designs[front].sort_values('Hu').reset_index(drop=True)
+
+    if show_plot:
+        plt.figure()
+        plt.scatter(designs['L'], designs['Hu'], s=2, color='grey', label='Geometrien')
+        plt.plot(pareto['L'], pareto['Hu'], color='r', marker='+', label='Pareto-Front')
+        plt.xlabel('L [m]')
+        plt.ylabel('Hu [m]')
+        plt.legend()
+        plt.show()
+
+    return pareto
+
+
 class FlapGate():
 
+    # Verhältnis mu(alpha)/mu(90°) in Abhängigkeit vom Klappenwinkel
+    mu_verhältnis = np.array([[-42.74, 0.9143],
+                              [-39.05, 0.92],
+                              [-35.07, 0.9271],
+                              [-31.1, 0.9343],
+                              [-27.21, 0.9434],
+                              [-23.15, 0.9496],
+                              [-19.17, 0.9571],
+                              [-15.2, 0.9659],
+                              [-11.22, 0.9743],
+                              [-7.24, 0.9831],
+                              [-3.274, 0.9926],
+                              [0.6412, 1.002],
+                              [2.418, 1.009],
+                              [5.761, 1.015],
+                              [9.555, 1.025],
+                              [13.5, 1.034],
+                              [16.96, 1.046],
+                              [20.76, 1.055],
+                              [24.37, 1.065],
+                              [27.98, 1.074],
+                              [31.78, 1.084],
+                              [35.75, 1.094],
+                              [39.73, 1.104],
+                              [43.82, 1.11],
+                              [47.68, 1.118],
+                              [51.65, 1.124],
+                              [55.63, 1.128],
+                              [59.6, 1.131],
+                              [63.58, 1.13],
+                              [67.55, 1.127],
+                              [71.35, 1.119],
+                              [74.42, 1.109],
+                              [76.72, 1.098],
+                              [80.02, 1.079],
+                              [81.29, 1.069],
+                              [82.37, 1.058],
+                              [83.27, 1.051],
+                              [84.18, 1.038],
+                              [84.9, 1.03],
+                              [85.8, 1.015]])
+
+    # Abminderungsfaktor bei Rückstau in Abhängigkeit von hd/h0
+    Abminderung_fak = np.array([[0.0112, 0.9916],
+                                [0.0718, 0.9764],
+                                [0.1610, 0.9473],
+                                [0.2191, 0.9268],
+                                [0.2801, 0.9032],
+                                [0.3396, 0.8775],
+                                [0.3992, 0.8500],
+                                [0.4588, 0.8201],
+                                [0.5184, 0.7877],
+                                [0.5780, 0.7525],
+                                [0.6377, 0.7127],
+                                [0.6976, 0.6707],
+                                [0.7572, 0.6168],
+                                [0.8107, 0.5622],
+                                [0.9055, 0.4440],
+                                [0.9382, 0.4055],
+                                [1, 0.3]])
+
     def __init__(self, bottom_level=None, downstream_water_level=None, discharge=None, flap_gate_width=None, flap_gate_height=None, flap_gate_angle=None,
                  show_errors=0, skip_zero_check=False):  # instance attribute
         self.Sh = bottom_level  # Sohlhöhe [m ü. NHN]
@@ -549,68 +1497,11 @@ class FlapGate():
 
     def abflussbeiwert(self):
 
-        self.mu_verhältnis = np.array([[-42.74, 0.9143],
-                                       [-39.05, 0.92],
-                                       [-35.07, 0.9271],
-                                       [-31.1, 0.9343],
-                                       [-27.21, 0.9434],
-                                       [-23.15, 0.9496],
-                                       [-19.17, 0.9571],
-                                       [-15.2, 0.9659],
-                                       [-11.22, 0.9743],
-                                       [-7.24, 0.9831],
-                                       [-3.274, 0.9926],
-                                       [0.6412, 1.002],
-                                       [2.418, 1.009],
-                                       [5.761, 1.015],
-                                       [9.555, 1.025],
-                                       [13.5, 1.034],
-                                       [16.96, 1.046],
-                                       [20.76, 1.055],
-                                       [24.37, 1.065],
-                                       [27.98, 1.074],
-                                       [31.78, 1.084],
-                                       [35.75, 1.094],
-                                       [39.73, 1.104],
-                                       [43.82, 1.11],
-                                       [47.68, 1.118],
-                                       [51.65, 1.124],
-                                       [55.63, 1.128],
-                                       [59.6, 1.131],
-                                       [63.58, 1.13],
-                                       [67.55, 1.127],
-                                       [71.35, 1.119],
-                                       [74.42, 1.109],
-                                       [76.72, 1.098],
-                                       [80.02, 1.079],
-                                       [81.29, 1.069],
-                                       [82.37, 1.058],
-                                       [83.27, 1.051],
-                                       [84.18, 1.038],
-                                       [84.9, 1.03],
-                                       [85.8, 1.015]])
-
         self.mu_ratio = np.interp(self.Kalpha, self.mu_verhältnis[:, 0], self.mu_verhältnis[:, 1])
 
     def abminderung_faktor(self):
 
-        self.Abminderung_fak = np.array([[0.0112, 0.9916],
-                                         [0.0718, 0.9764],
-                                         [0.1610, 0.9473],
-                                         [0.2191, 0.9268],
-                                         [0.2801, 0.9032],
-                                         [0.3396, 0.8775],
-                                         [0.3992, 0.8500],
-                                         [0.4588, 0.8201],
-                                         [0.5184, 0.7877],
-                                         [0.5780, 0.7525],
-                                         [0.6377, 0.7127],
-                                         [0.6976, 0.6707],
-                                         [0.7572, 0.6168],
-                                         [0.8107, 0.5622],
-                                         [0.9055, 0.4440],
-                                         [0.9382, 0.4055],
-                                         [1, 0.3]])
+        return self.Abminderung_fak
 
     def cal_P_neu(self):
         self.P_neu = self.KP * (math.cos(math.radians(abs(self.Kalpha))))
@@ -728,6 +1619,143 @@ class FlapGate():
               'Unterwasserstand =%2.2f [m ü. NHN]' % self.UW, '\n')
 
 
+# Vektorisierte Bisektion: f(x) muss monoton steigend sein mit f(lo) <= 0 < f(hi)
+def _bisektion(f, lo, hi, iterations=100):
+    lo = np.array(lo, dtype=float)
+    hi = np.array(hi, dtype=float)
+
+    for _ in range(iterations):
+        mid = 0.5 * (lo + hi)
+        positiv = f(mid) > 0
+        hi = np.where(positiv, mid, hi)
+        lo = np.where(positiv, lo, mid)
+
+    return 0.5 * (lo + hi)
+
+
+# Berechnung der Klappe für beliebig viele Abflüsse, Unterwasserstände und Winkel in einem Schritt.
+# Die Ergebnisse entsprechen FlapGate(...).update(), werden aber als dict von Arrays zurückgegeben
+# (records=True: Eingaben und Ergebnisse als Structured-Array, siehe result_records).
+# validate=True wie bei labyrinth_batch (validate_flap_gate_inputs).
+def flap_gate_batch(bottom_level, downstream_water_level, discharge, flap_gate_width, flap_gate_height,
+                    flap_gate_angle, gravity=9.81, max_iterations=1000, records=False, validate=False):
+    Sh, UW, Q, KW, KP, Kalpha = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (
+        bottom_level, downstream_water_level, discharge, flap_gate_width, flap_gate_height, flap_gate_angle)))
+
+    if validate:
+        pruefung = validate_flap_gate_inputs(Sh, UW, Q, KW, KP, Kalpha)
+        Q = np.where(pruefung['gültig'], Q, np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        mu_ratio = np.interp(Kalpha, FlapGate.mu_verhältnis[:, 0], FlapGate.mu_verhältnis[:, 1])
+        P_neu = KP * np.cos(np.radians(np.abs(Kalpha)))
+
+        # Iteration wie in FlapGate.cal_Q, konvergierte Elemente werden eingefroren
+        mu_alt = np.full(Q.shape, 0.1)
+        mu = np.full(Q.shape, np.nan)
+        hu = np.full(Q.shape, np.nan)
+        aktiv = np.ones(Q.shape, dtype=bool)
+
+        for _ in range(max_iterations):
+            hu_alt = np.power(Q / (2.953 * mu_alt * KW), 2 / 3)
+            mu90_neu = 0.615 * (1 + (1 / (1000 * hu_alt + 1.6))) * (1 + (0.5 * np.power(hu_alt / (hu_alt + P_neu), 2)))
+            mu_neu = mu_ratio * mu90_neu
+            Q_neu = 2.953 * mu_neu * KW * np.power(hu_alt, 3 / 2)
+
+            fertig = aktiv & (np.abs(Q_neu - Q) < 0.01)
+            mu[fertig] = mu_neu[fertig]
+            hu[fertig] = hu_alt[fertig]
+
+            aktiv &= ~fertig & np.isfinite(Q_neu)
+            if not aktiv.any():
+                break
+            mu_alt = np.where(aktiv, mu_neu, mu_alt)
+
+        # Rückstaueinfluss, Lösung von FlapGate.cal_ruckstauH per Bisektion statt fsolve
+        hd = (UW - Sh) - P_neu
+        rs = hd > 0
+
+        if rs.any():
+            hd_r, P_r, mu_r, KW_r, Q_r = hd[rs], P_neu[rs], mu_ratio[rs], KW[rs], Q[rs]
+
+            def f(h):
+                return (np.power(1 - np.power(hd_r / h, 1.15), 0.37) * 2.953
+                        * 0.615 * (1 + (1 / (1000 * h + 1.6))) * (1 + (0.5 * np.power(h / (h + P_r), 2)))
+                        * mu_r * KW_r * np.power(h, 1.5) - Q_r)
+
+            hi = hd_r + np.maximum(np.nan_to_num(hu[rs]), 0.01)
+            for _ in range(60):
+                zu_klein = f(hi) <= 0
+                if not zu_klein.any():
+                    break
+                hi = np.where(zu_klein, hd_r + 2 * (hi - hd_r), hi)
+
+            hu[rs] = _bisektion(f, hd_r, hi)
+
+        v = np.where(hu == 0, np.nan, Q / (KW * hu))
+        yu = Sh + P_neu + hu
+        vd = Q / (KW * (UW - Sh))
+
+        h_gr = np.power(np.power(Q / KW, 2) / gravity, 0.33)
+        v_gr = np.power(gravity * h_gr, 0.5)
+        beschleunigung = (v_gr - v) / (KP * np.sin(np.radians(np.abs(Kalpha))))
+
+    ergebnis = {'mu_ratio': mu_ratio, 'P_neu': P_neu, 'mu': mu, 'hu': hu, 'hd': hd, 'v': v, 'yu': yu, 'vd': vd,
+                'h_gr': h_gr, 'v_gr': v_gr, 'beschleunigung': beschleunigung}
+
+    if validate:
+        ergebnis = {name: wert if isinstance(wert, dict) else np.where(pruefung['gültig'], wert, np.nan)
+                    for name, wert in ergebnis.items()}
+        ergebnis.update({'Fehlercode': pruefung['code'], 'gültig': pruefung['gültig']})
+
+    if records:
+        return result_records({'Sh': Sh, 'UW': UW, 'Q': Q, 'KW': KW, 'KP': KP, 'Kalpha': Kalpha, **ergebnis})
+
+    return ergebnis
+
+
+# Abfluss über die Klappe bei vorgegebenem Oberwasserstand (Umkehrung von flap_gate_batch), explizit aus
+# der Abflussformel in FlapGate.cal_Q bzw. FlapGate.cal_ruckstauH mit hu = Oberwasserstand - Klappenoberkante
+def flap_gate_discharge_batch(bottom_level, downstream_water_level, upstream_water_level, flap_gate_width,
+                              flap_gate_height, flap_gate_angle):
+    Sh, UW, yu, KW, KP, Kalpha = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (
+        bottom_level, downstream_water_level, upstream_water_level, flap_gate_width, flap_gate_height,
+        flap_gate_angle)))
+
+    mu_ratio = np.interp(Kalpha, FlapGate.mu_verhältnis[:, 0], FlapGate.mu_verhältnis[:, 1])
+    P_neu = KP * np.cos(np.radians(np.abs(Kalpha)))
+    hu = yu - Sh - P_neu
+    hd = (UW - Sh) - P_neu
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mu90 = 0.615 * (1 + (1 / (1000 * hu + 1.6))) * (1 + (0.5 * np.power(hu / (hu + P_neu), 2)))
+        Q = 2.953 * mu_ratio * mu90 * KW * np.power(hu, 1.5)
+        Q = np.where(hd > 0, np.power(1 - np.power(hd / hu, 1.15), 0.37) * Q, Q)
+
+    return np.where((hu > 0) & (hu > hd), Q, 0.0)
+
+
+# Festes Wehrfeld (Poleni, Rückstau nach Villemonte) als weiteres Bauwerk für parallel_structures_batch.
+# discharge(upstream_water_level, downstream_water_level) ist vektorisiert, 0 bei Wasserstand unter der Krone.
+class FixedWeir():
+    def __init__(self, bottom_level, weir_height, weir_width, mu=0.6, gravity=9.81):
+        self.Sh = bottom_level  # Sohlhöhe [m]
+        self.P = weir_height  # Wehrhöhe [m]
+        self.W = weir_width  # Wehrbreite [m]
+        self.mu = mu  # Überfallbeiwert nach Poleni [-]
+        self.gravity = gravity
+
+    def discharge(self, upstream_water_level, downstream_water_level):
+        hu = np.asarray(upstream_water_level, dtype=float) - self.Sh - self.P
+        hd = np.asarray(downstream_water_level, dtype=float) - self.Sh - self.P
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Q = (2 / 3) * self.mu * self.W * math.sqrt(2 * self.gravity) * np.power(hu, 1.5)
+            Q = np.where(hd > 0, Q * np.power(1 - np.power(hd / hu, 1.5), 0.385), Q)
+
+        return np.where((hu > 0) & (hu > hd), Q, 0.0)
+
+
 def kopplung(Q, UW, Lab, Kla):  # Funktion zur Optimierung der Entladung zwischen Labyrinth und Klappe
 
     def check_and_exit_on_input_errors():
@@ -854,6 +1882,38 @@ def kopplung(Q, UW, Lab, Kla):  # Funktion zur Optimierung der Entladung zwische
         return Lab.Q, Kla.Q, Lab.yu, Kla.yu
 
 
+# Anpassung der Unterwasserkurve, Rückgabe: Funktion UW(Q) und Bestimmtheitsmaß R²
+def UW_fit(Abfluss, Unterwasser, interpolation):
+    Abfluss = np.asarray(Abfluss, dtype=float)
+    Unterwasser = np.asarray(Unterwasser, dtype=float)
+
+    if interpolation == 'exponential':
+        def model_f(x, a, b, c):
+            return a * (np.exp(b * x)) + c
+
+        popt, pcov = curve_fit(model_f, Abfluss, Unterwasser, p0=[0., 0.1, 0.1], maxfev=2000)
+        a_opt, b_opt, c_opt = popt
+
+        def model(Q):
+            return a_opt * (np.exp(b_opt * np.asarray(Q, dtype=float))) + c_opt
+
+    elif interpolation in ('linear', 'quadratic', 'cubic'):
+        deg = {'linear': 1, 'quadratic': 2, 'cubic': 3}[interpolation]
+        model = np.poly1d(np.polyfit(Abfluss, Unterwasser, deg))
+
+    else:
+        raise ValueError("Interpolationsmethode ist ungültig.")
+
+    UW1 = model(Abfluss)
+
+    # Calculate R-squared
+    SSR = np.sum((Unterwasser - UW1) ** 2)
+    SST = np.sum((Unterwasser - np.mean(UW1)) ** 2)
+    R_squared = 1 - (SSR / SST)
+
+    return model, R_squared
+
+
 def UW_interpolation(Abfluss, Unterwasser, Q_con, interpolation, path='', show_plot=False, save_plot=False):
     def check_and_exit_on_input_errors():
         def input_plausibilty(eingabe_name, eingabe_wert, max_value=None, min_value=None):
@@ -901,64 +1961,9 @@ def UW_interpolation(Abfluss, Unterwasser, Q_con, interpolation, path='', show_p
         return fehler
 
     def perform_interpolation(interpolation, Abfluss, Unterwasser, Q_con):
-        if interpolation == 'exponential':
-            def model_f(x, a, b, c):
-                return a * (np.exp(b * x)) + c
-
-            popt, pcov = curve_fit(model_f, Abfluss, Unterwasser, p0=[0., 0.1, 0.1], maxfev=2000)
-            a_opt, b_opt, c_opt = popt
-
-            UW1 = a_opt * (np.exp(b_opt * Abfluss)) + c_opt
-            UW2 = a_opt * (np.exp(b_opt * Q_con)) + c_opt
-
-            # Calculate Mean Squared Error
-            MSE = np.mean((Unterwasser - UW1) ** 2)
-            # Calculate R-squared
-            SSR = np.sum((Unterwasser - UW1) ** 2)
-            SST = np.sum((Unterwasser - np.mean(UW1)) ** 2)
-            R_squared = 1 - (SSR / SST)
-
-        elif interpolation == 'linear':
-            coeffs = np.polyfit(Abfluss, Unterwasser, 1)
-            p = np.poly1d(coeffs)
-
-            UW1 = p(Abfluss)
-            UW2 = p(Q_con)
-            # Calculate Mean Squared Error
-            MSE = np.mean((Unterwasser - UW1) ** 2)
-            # Calculate R-squared
-            SSR = np.sum((Unterwasser - UW1) ** 2)
-            SST = np.sum((Unterwasser - np.mean(UW1)) ** 2)
-            R_squared = 1 - (SSR / SST)
-
-        elif interpolation == 'quadratic':
-            coeffs = np.polyfit(Abfluss, Unterwasser, 2)
-            p = np.poly1d(coeffs)
-
-            UW1 = p(Abfluss)
-            UW2 = p(Q_con)
-            # Calculate Mean Squared Error
-            # MSE = np.mean((Unterwasser - UW1) ** 2)
-
-            # Calculate R-squared
-            SSR = np.sum((Unterwasser - UW1) ** 2)
-            SST = np.sum((Unterwasser - np.mean(UW1)) ** 2)
-            R_squared = 1 - (SSR / SST)
-
-        elif interpolation == 'cubic':
-            coeffs = np.polyfit(Abfluss, Unterwasser, 3)
-            p = np.poly1d(coeffs)
-
-            UW1 = p(Abfluss)
-            UW2 = p(Q_con)
-            # Calculate Mean Squared Error
-            MSE = np.mean((Unterwasser - UW1) ** 2)
-            # Calculate R-squared
-            SSR = np.sum((Unterwasser - UW1) ** 2)
-            SST = np.sum((Unterwasser - np.mean(UW1)) ** 2)
-            R_squared = 1 - (SSR / SST)
-
-        return UW2, R_squared
+        model, R_squared = UW_fit(Abfluss, Unterwasser, interpolation)
+
+        return model(Q_con), R_squared
 
     def plot_interpolation(interpolation, Q_con, UW, Abfluss, Unterwasser, R_squared):
         # plt.close()
@@ -973,6 +1978,7 @@ def UW_interpolation(Abfluss, Unterwasser, Q_con, interpolation, path='', show_p
             plt.savefig(path + 'Q_UW_interpolation_{}.pdf'.format(interpolation))
         if show_plot:
             plt.show()
+        plt.close()
 
     # Q_con = np.arange(0.1, np.max(Abfluss) + 0.5, 0.5)
     interpolation_types = ['exponential', 'linear', 'quadratic', 'cubic']
@@ -983,6 +1989,8 @@ def UW_interpolation(Abfluss, Unterwasser, Q_con, interpolation, path='', show_p
     if interpolation == 'all':
         for i, interp_type in enumerate(interpolation_types):
             UW, R_squared = perform_interpolation(interp_type, Abfluss, Unterwasser, Q_con)
+            if not (show_plot or save_plot):
+                continue
             plot_color = plot_colors[i % len(plot_colors)]
             plt.plot(Q_con, UW, color=plot_color)
             plt.scatter(Abfluss, Unterwasser, color='red')
@@ -997,18 +2005,71 @@ def UW_interpolation(Abfluss, Unterwasser, Q_con, interpolation, path='', show_p
 
         if show_plot:
             plt.show()
-
-
+        if show_plot or save_plot:
+            plt.close()
 
     else:
         UW, R_squared = perform_interpolation(interpolation, Abfluss, Unterwasser, Q_con)
-        plot_interpolation(interpolation, Q_con, UW, Abfluss, Unterwasser, R_squared)
+        # ohne Anzeige und Speichern keine Figur anlegen (sonst sammeln sich offene Figuren in Prozesspools)
+        if show_plot or save_plot:
+            plot_interpolation(interpolation, Q_con, UW, Abfluss, Unterwasser, R_squared)
 
     return UW
 
 
+# Adaptives Abflussraster für operational_model. berechnung(Q, vorher) liefert ein dict mit 'OW' und 'regime'
+# (Tupel von Zustandsflags) für den Abfluss Q, vorher ist das Ergebnis des nächstkleineren Abflusses (oder None).
+# Start ist ein grobes Raster mit stepsize; ein Intervall wird halbiert, solange der Oberwasserstand in der Mitte
+# mehr als tolerance von der linearen Interpolation abweicht (bis min_stepsize), und solange sich das Regime
+# zwischen den Intervallenden ändert (Bisektion bis transition_tolerance).
+# Ausgewertet wird immer von links nach rechts, damit vorher der linke Nachbar ist.
+# Rückgabe: Abflüsse (aufsteigend) und die dazugehörigen Ergebnisse.
+def _adaptive_discharge_grid(berechnung, Q_start, Q_end, stepsize, tolerance, min_stepsize, transition_tolerance,
+                             punkte=None, sichern=None):
+    Q_grob = np.arange(Q_start, Q_end, stepsize)
+    Q_grob = np.append(Q_grob[Q_grob < Q_end - 1e-9], Q_end)
+
+    # punkte: Zwischenstand eines abgebrochenen Laufs, sichern(punkte) nach jedem groben Intervall
+    if not punkte:
+        punkte = [(Q_grob[0], berechnung(Q_grob[0], None))]
+
+    # hängt alle Punkte in (links, rechts] aufsteigend an
+    def verfeinern(links, rechts):
+        (Q_l, w_l), (Q_r, w_r) = links, rechts
+        breite = Q_r - Q_l
+        wechsel = w_l['regime'] != w_r['regime']
+
+        if breite > (transition_tolerance if wechsel else min_stepsize):
+            Q_m = 0.5 * (Q_l + Q_r)
+            mitte = (Q_m, berechnung(Q_m, w_l))
+            if wechsel or abs(mitte[1]['OW'] - 0.5 * (w_l['OW'] + w_r['OW'])) > tolerance:
+                verfeinern(links, mitte)
+                verfeinern(mitte, rechts)
+                return
+            punkte.append(mitte)
+        punkte.append(rechts)
+
+    for Q in Q_grob[Q_grob > punkte[-1][0]]:
+        links = punkte[-1]
+        verfeinern(links, (Q, berechnung(Q, links[1])))
+        if sichern is not None:
+            sichern(punkte)
+
+    return np.array([p[0] for p in punkte]), [p[1] for p in punkte]
+
+
+# write_files=False: keine Dateien (CSV, Plot der Unterwasserkurve) und keine Abbildung, z.B. für ScenarioPool
+# discharge_start: erster Abfluss des Rasters (Standard: kleinster Abfluss in discharge_vector).
+# adaptive=True: Raster mit interpolation_stepsize, das nur dort verfeinert wird, wo sich der Oberwasserstand
+# schnell ändert (tolerance in m, bis min_stepsize); Regimewechsel (Rückstau hd > 0, Klappe im maximalen Winkel,
+# Beginn des Labyrinthüberfalls) werden per Bisektion auf transition_tolerance genau eingegrenzt.
+# checkpoint: Datei für den Zwischenstand (berechnete Rasterpunkte samt Klappenwinkel als Startwert für den
+# nächsten Abfluss), höchstens alle checkpoint_interval Sekunden gespeichert. Ein abgebrochener Lauf mit
+# denselben Eingaben setzt dort fort und liefert dasselbe Ergebnis wie ein Lauf ohne Unterbrechung.
 def operational_model(labyrinth_object, discharge_vector, downstream_water_level_vector, upstream_water_level_vector, interpolation_method, interpolation_stepsize=1, flap_gate_opject=None, design_upstream_water_level=None, max_flap_gate_angle=None,
-                      fish_body_height=None, show_plot=False, save_plot=False, path=""):
+                      fish_body_height=None, show_plot=False, save_plot=False, path="", write_files=True,
+                      discharge_start=None, adaptive=False, tolerance=0.01, min_stepsize=None, transition_tolerance=None,
+                      checkpoint=None, checkpoint_interval=60):
     def check_and_exit_on_input_errors():
         def input_plausibilty(eingabe_name, eingabe_wert, max_value=None, min_value=None):
             fehler = []  # Store error messages
@@ -1064,23 +2125,59 @@ def operational_model(labyrinth_object, discharge_vector, downstream_water_level
             print(f"{i}. {fehler_message}")
         return fehler
 
-    def operational_model_without_flap():
+    # Abflussraster und Berechnung aller Rasterpunkte; berechnung(Q, UW, vorher) wie in _adaptive_discharge_grid
+    def diskretisierung(berechnung):
+        Q_start = np.min(discharge_vector) if discharge_start is None else discharge_start
+
+        Lab, Kla = labyrinth_object, flap_gate_opject
+        sicherung = _Checkpoint(checkpoint, ('operational_model', np.asarray(discharge_vector).tolist(),
+                                             np.asarray(downstream_water_level_vector).tolist(), interpolation_method,
+                                             interpolation_stepsize, Q_start, adaptive, tolerance, min_stepsize,
+                                             transition_tolerance, (Lab.Sh, Lab.W, Lab.P, Lab.B, Lab.alpha, Lab.D),
+                                             None if Kla is None else (Kla.Sh, Kla.KW, Kla.KP),
+                                             design_upstream_water_level, max_flap_gate_angle), checkpoint_interval)
+
+        if not adaptive:
+            # Q_con = np.arange(0.1, np.max(discharge_vector) + 0.5, 0.5)
+            # wie np.arange(Q_start, max + stepsize, stepsize), aber der letzte Wert liegt sicher >= max
+            # (sonst schlägt die Interpolation der Ereignisse in save_results bei Rundungsfehlern fehl)
+            n = int(np.ceil((np.max(discharge_vector) - Q_start) / interpolation_stepsize - 1e-9)) + 1
+            Q_con = Q_start + interpolation_stepsize * np.arange(n)
+            UW_con = UW_interpolation(discharge_vector, downstream_water_level_vector, Q_con, interpolation_method, path=path, save_plot=write_files)
+
+            werte = sicherung.laden() or []
+            for Q, UW in zip(Q_con[len(werte):], UW_con[len(werte):]):
+                werte.append(berechnung(Q, UW, werte[-1] if werte else None))
+                sicherung.speichern(werte)
+            sicherung.entfernen()
+
+            return Q_con, UW_con, werte
+
+        UW_model, _ = UW_fit(discharge_vector, downstream_water_level_vector, interpolation_method)
+        Q_con, werte = _adaptive_discharge_grid(
+            lambda Q, vorher: berechnung(Q, float(UW_model(Q)), vorher), Q_start, np.max(discharge_vector),
+            interpolation_stepsize, tolerance,
+            interpolation_stepsize / 32 if min_stepsize is None else min_stepsize,
+            interpolation_stepsize / 1024 if transition_tolerance is None else transition_tolerance,
+            punkte=sicherung.laden(), sichern=sicherung.speichern)
+        sicherung.entfernen()
+        UW_con = UW_interpolation(discharge_vector, downstream_water_level_vector, Q_con, interpolation_method, path=path, save_plot=write_files)
+
+        return Q_con, UW_con, werte
 
-        # Q_con = np.arange(0.1, np.max(discharge_vector) + 0.5, 0.5)
-        Q_con = np.arange(50, np.max(discharge_vector) + interpolation_stepsize, interpolation_stepsize)
-        UW_con = UW_interpolation(discharge_vector, downstream_water_level_vector, Q_con, interpolation_method, path=path, save_plot=True)
-        Q_UW = np.stack((Q_con, UW_con), axis=1)
-
-        Lab_upstream = np.zeros(np.size(Q_con))
-        Lab_hu = np.zeros(np.size(Q_con))
+    def operational_model_without_flap():
 
-        for i, (Q, UW) in enumerate(zip(Q_UW[:, 0], Q_UW[:, 1])):
-            # print(Q)
+        def berechnung(Q, UW, vorher):
             labyrinth_object.Q = Q
             labyrinth_object.UW = UW
             labyrinth_object.update()
-            Lab_upstream[i] = labyrinth_object.yu
-            Lab_hu[i] = labyrinth_object.hu
+            return {'OW': labyrinth_object.yu, 'hu': labyrinth_object.hu, 'regime': (labyrinth_object.hd > 0,)}
+
+        Q_con, UW_con, werte = diskretisierung(berechnung)
+        Q_UW = np.stack((Q_con, UW_con), axis=1)
+
+        Lab_upstream = np.array([w['OW'] for w in werte])
+        Lab_hu = np.array([w['hu'] for w in werte])
 
         def print_results():
             fig, ax = plt.subplots(3, sharex=True)
@@ -1121,9 +2218,9 @@ def operational_model(labyrinth_object, discharge_vector, downstream_water_level
 
             results_df = results_df.round(2)
 
-            if path:
+            if write_files and path:
                 results_df.to_csv(path + '\\results.csv', sep=';', float_format='%.2f', header=results_col)
-            else:
+            elif write_files:
                 results_df.to_csv('results.csv', sep=';', float_format='%.2f', header=results_col)
 
             '''save the results for specific discahrge events'''
@@ -1142,45 +2239,28 @@ def operational_model(labyrinth_object, discharge_vector, downstream_water_level
             results_events_df.columns = results_events_col
             results_events_df = results_events_df.round(2)
 
-            if path:
+            if write_files and path:
                 results_events_df.to_csv(path + '\\results_events.csv', sep=';', float_format='%.2f',
                                          header=results_events_col)
-            else:
+            elif write_files:
                 results_events_df.to_csv('results_events.csv', sep=';', float_format='%.2f',
                                          header=results_events_col)
 
             return results_df, results_events_df
 
         results, results_events = save_results()
-        print_results()
+        if write_files or show_plot or save_plot:
+            print_results()
 
         return results, results_events
 
     def operational_model_with_flap():
-        # Q_con = np.arange(0.1, np.max(discharge_vector) + 0.5, 0.5)
-        Q_con = np.arange(50, np.max(discharge_vector) + interpolation_stepsize, interpolation_stepsize)
         SZ = design_upstream_water_level
         Klawinkel_Max = max_flap_gate_angle
 
-        Klappe_al = np.zeros(np.size(Q_con))
-        Abfluss_R = np.zeros(np.size(Q_con))
-        Lab_Q = np.zeros(np.size(Q_con))
-        Kla_Q = np.zeros(np.size(Q_con))
-        Lab_upstream = np.zeros(np.size(Q_con))
-        Kla_upstream = np.zeros(np.size(Q_con))
-
-        Kla_hu = np.zeros(np.size(Q_con))
-        Kla_vd = np.zeros(np.size(Q_con))
-
-        P_new = np.zeros(np.size(Q_con))
-
         flap_gate_opject.Kalpha = 0
 
-        UW_con = UW_interpolation(discharge_vector, downstream_water_level_vector, Q_con, interpolation_method, path=path, save_plot=True)
-        Q_UW = np.stack((Q_con, UW_con), axis=1)
-
-        for i, (Q, UW) in enumerate(zip(Q_UW[:, 0], Q_UW[:, 1])):
-            # print(Q)
+        def berechnung(Q, UW, vorher):
             # =============================================================================
             #         alpha = np.arange(Kla.Kalpha, KlappeWinkel_max+0.2,0.2)
             #
@@ -1203,26 +2283,36 @@ def operational_model(labyrinth_object, discharge_vector, downstream_water_level
 
                 return abs(flap_gate_opject.yu - SZ)
 
-            # initial values
-            Kalpha0 = Klappe_al[i - 1] if i > 0 else [10]
-            Kalpha_min = Klappe_al[i - 1] if i > 0 else 0
+            # initial values (Winkel beim vorherigen, kleineren Abfluss)
+            Kalpha0 = vorher['Klappe_al'] if vorher is not None else [10]
+            Kalpha_min = vorher['Klappe_al'] if vorher is not None else 0
 
             # minmize function
             result = minimize_scalar(Objective_fn, Kalpha0, bounds=(Kalpha_min, Klawinkel_Max), method='bounded')
 
-            Klappe_al[i] = result.x
-            # print(result.x)
-
-            Kla_upstream[i] = flap_gate_opject.yu
-
-            Kla_hu[i] = flap_gate_opject.hu
-            Kla_vd[i] = flap_gate_opject.vd
+            return {'Klappe_al': result.x,
+                    'OW': flap_gate_opject.yu,
+                    'Kla_hu': flap_gate_opject.hu,
+                    'Kla_vd': flap_gate_opject.vd,
+                    'Lab_upstream': labyrinth_object.yu,
+                    'Abfluss_R': labyrinth_object.Q / flap_gate_opject.Q,
+                    'Lab_Q': labyrinth_object.Q,
+                    'Kla_Q': flap_gate_opject.Q,
+                    'P_new': flap_gate_opject.P_neu,
+                    'regime': (labyrinth_object.hd > 0, Klawinkel_Max - result.x < 0.01, labyrinth_object.Q > 0)}
+
+        Q_con, UW_con, werte = diskretisierung(berechnung)
+        Q_UW = np.stack((Q_con, UW_con), axis=1)
 
-            Lab_upstream[i] = labyrinth_object.yu
-            Abfluss_R[i] = labyrinth_object.Q / flap_gate_opject.Q
-            Lab_Q[i] = labyrinth_object.Q
-            Kla_Q[i] = flap_gate_opject.Q
-            P_new[i] = flap_gate_opject.P_neu
+        Klappe_al = np.array([w['Klappe_al'] for w in werte])
+        Kla_upstream = np.array([w['OW'] for w in werte])
+        Kla_hu = np.array([w['Kla_hu'] for w in werte])
+        Kla_vd = np.array([w['Kla_vd'] for w in werte])
+        Lab_upstream = np.array([w['Lab_upstream'] for w in werte])
+        Abfluss_R = np.array([w['Abfluss_R'] for w in werte])
+        Lab_Q = np.array([w['Lab_Q'] for w in werte])
+        Kla_Q = np.array([w['Kla_Q'] for w in werte])
+        P_new = np.array([w['P_new'] for w in werte])
 
         # return Q_con, Lab_Q, Kla_Q, Klappe_al, y_upstream
 
@@ -1299,9 +2389,9 @@ def operational_model(labyrinth_object, discharge_vector, downstream_water_level
 
             results_df = results_df.round(2)
 
-            if path:
+            if write_files and path:
                 results_df.to_csv(path + '\\results.csv', sep=';', float_format='%.2f', header=results_col)
-            else:
+            elif write_files:
                 results_df.to_csv('results.csv', sep=';', float_format='%.2f', header=results_col)
 
             '''save the results for specific discahrge events'''
@@ -1320,17 +2410,18 @@ def operational_model(labyrinth_object, discharge_vector, downstream_water_level
             results_events_df.columns = results_events_col
             results_events_df = results_events_df.round(2)
 
-            if path:
+            if write_files and path:
                 results_events_df.to_csv(path + '\\results_events.csv', sep=';', float_format='%.2f',
                                          header=results_events_col)
-            else:
+            elif write_files:
                 results_events_df.to_csv('results_events.csv', sep=';', float_format='%.2f',
                                          header=results_events_col)
 
             return results_df, results_events_df
 
         results, results_events = save_results()
-        print_results()
+        if write_files or show_plot or save_plot:
+            print_results()
 
         return results, results_events
 
@@ -1342,6 +2433,1122 @@ def operational_model(labyrinth_object, discharge_vector, downstream_water_level
     return results, results_events
 
 
+# Abflussaufteilung zwischen Labyrinth und Klappe (wie kopplung) für beliebig viele Abflüsse in einem Schritt.
+# Bisektion über den Labyrinthabfluss q: Oberwasser aus labyrinth_batch(q), daraus der Klappenabfluss bei
+# diesem Oberwasser (flap_gate_discharge_batch); gesucht ist q + Q_Klappe = Q.
+# Reicht die Klappe schon unterhalb der Labyrinthkrone, fließt alles über die Klappe.
+# Genauigkeit: die Abflusssumme stimmt nach iterations Schritten bis auf Q * 2^-iterations, der Oberwasserstand
+# aber nur so genau wie die Iteration in labyrinth_batch (Abbruch bei 0.01 m³/s); gegenüber kopplung
+# (scipy.optimize.minimize) ergeben sich Abweichungen bis etwa 1 mm.
+# Rückgabe: Labyrinthabfluss, Klappenabfluss und Oberwasserstand.
+def _kopplung_batch(Lab, Kla, Q, UW, Kalpha, iterations=50):
+    Q, UW, Kalpha = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (Q, UW, Kalpha)))
+
+    def oberwasser(q):
+        return labyrinth_batch(Lab.Sh, UW, q, Lab.W, Lab.P, Lab.B, Lab.alpha, D=Lab.D, gravity=Lab.gravity)['yu']
+
+    def f(q):
+        return q + flap_gate_discharge_batch(Kla.Sh, UW, oberwasser(q), Kla.KW, Kla.KP, Kalpha) - Q
+
+    nur_klappe = ~(f(np.zeros(Q.shape)) < 0)
+    Lab_Q = np.where(nur_klappe, 0.0, _bisektion(f, np.zeros(Q.shape), Q, iterations=iterations))
+    OW = np.where(nur_klappe, flap_gate_batch(Kla.Sh, UW, Q, Kla.KW, Kla.KP, Kalpha, gravity=Kla.g)['yu'],
+                  oberwasser(Lab_Q))
+
+    return Lab_Q, Q - Lab_Q, OW
+
+
+# Abflussaufteilung auf beliebig viele parallele Bauwerke (Labyrinth, Klappe im Winkel Kalpha, FixedWeir oder
+# eigene Bauwerke mit discharge(upstream_water_level, downstream_water_level) bzw. als Funktion davon) für
+# beliebig viele Abflüsse und Unterwasserstände in einem Schritt.
+# Gesucht ist der gemeinsame Oberwasserstand h mit Summe Q_i(h, UW) = Q, eine Bisektion über h je Abfluss.
+# Jeder Schritt berechnet jedes Bauwerk einmal, der Aufwand steigt linear mit der Anzahl der Bauwerke.
+# Untere Grenze ist die niedrigste Krone bzw. das Unterwasser (kein Abfluss), die obere Grenze wird
+# verdoppelt, bis die Bauwerke den Abfluss abführen.
+# Rückgabe: dict mit 'OW' und 'Q' (Abfluss je Bauwerk, erste Achse = Bauwerk).
+def parallel_structures_batch(structures, discharge, downstream_water_level, iterations=60):
+    Q, UW = np.broadcast_arrays(np.asarray(discharge, dtype=float), np.asarray(downstream_water_level, dtype=float))
+
+    def abfluss(bauwerk, h):
+        if isinstance(bauwerk, Labyrinth):
+            return labyrinth_discharge_batch(bauwerk.Sh, UW, h, bauwerk.W, bauwerk.P, bauwerk.B, bauwerk.alpha,
+                                             D=bauwerk.D, gravity=bauwerk.gravity)
+        if isinstance(bauwerk, FlapGate):
+            return flap_gate_discharge_batch(bauwerk.Sh, UW, h, bauwerk.KW, bauwerk.KP, bauwerk.Kalpha)
+        if hasattr(bauwerk, 'discharge'):
+            return np.broadcast_to(bauwerk.discharge(h, UW), Q.shape)
+        return np.broadcast_to(bauwerk(h, UW), Q.shape)
+
+    def f(h):
+        return sum(abfluss(bauwerk, h) for bauwerk in structures) - Q
+
+    kronen = [bauwerk.Sh + bauwerk.P for bauwerk in structures if isinstance(bauwerk, (Labyrinth, FixedWeir))]
+    kronen += [bauwerk.Sh + bauwerk.KP * math.cos(math.radians(abs(bauwerk.Kalpha)))
+               for bauwerk in structures if isinstance(bauwerk, FlapGate)]
+    lo = np.minimum(UW, min(kronen)) if kronen else UW.copy()
+
+    # obere Grenze: Überfallhöhe verdoppeln, bis der Abfluss erreicht ist
+    schritt = np.ones(Q.shape)
+    hi = lo + schritt
+    for _ in range(60):
+        zu_klein = f(hi) < 0
+        if not zu_klein.any():
+            break
+        schritt = np.where(zu_klein, 2 * schritt, schritt)
+        hi = np.where(zu_klein, lo + schritt, hi)
+
+    OW = _bisektion(f, lo, hi, iterations=iterations)
+    OW = np.where(np.isfinite(Q) & np.isfinite(UW), OW, np.nan)
+
+    return {'OW': OW, 'Q': np.where(np.isnan(OW), np.nan, np.stack([abfluss(bauwerk, OW) for bauwerk in structures]))}
+
+
+# Oberwasserstand des Wehrs (Labyrinth, optional mit Klappe) für beliebig viele Abflüsse und Unterwasserstände
+# in einem Schritt (alle Eingaben werden gegeneinander gebroadcastet, np.nan bleibt erhalten).
+# Mit Klappe wird wie in operational_model das Stauziel design_upstream_water_level gehalten: der Klappenwinkel
+# ist der kleinste Winkel zwischen 0 und max_flap_gate_angle, bei dem
+# Q_Labyrinth(Stauziel) + Q_Klappe(Stauziel, Winkel) = Q gilt (Bisektion, der Klappenabfluss steigt mit dem
+# Winkel). Reicht der maximale Winkel nicht, steht die Klappe im maximalen Winkel und der Oberwasserstand steigt,
+# bei zu kleinem Abfluss ist die Klappe bei 0° und der Oberwasserstand liegt unter dem Stauziel.
+# Im Unterschied zu operational_model hängt der Winkel nur vom aktuellen Abfluss ab, nicht vom vorherigen.
+# Rückgabe: dict mit 'Abfluss', 'UW', 'OW', 'Labyrinth Q', 'Klappe Q', 'Klappe winkel'
+# (records=True: als Structured-Array, siehe result_records).
+def upstream_water_level_batch(labyrinth_object, discharge, downstream_water_level, flap_gate_opject=None,
+                               design_upstream_water_level=None, max_flap_gate_angle=None, records=False):
+    Lab = labyrinth_object
+    Q, UW = np.broadcast_arrays(np.asarray(discharge, dtype=float), np.asarray(downstream_water_level, dtype=float))
+
+    if flap_gate_opject is None:
+        yu = labyrinth_batch(Lab.Sh, UW, Q, Lab.W, Lab.P, Lab.B, Lab.alpha, D=Lab.D, gravity=Lab.gravity)['yu']
+        ergebnis = {'Abfluss': Q, 'UW': UW, 'OW': yu, 'Labyrinth Q': Q, 'Klappe Q': np.zeros(Q.shape),
+                    'Klappe winkel': np.full(Q.shape, np.nan)}
+        return result_records(ergebnis) if records else ergebnis
+
+    Kla = flap_gate_opject
+    SZ = design_upstream_water_level
+    Klawinkel_Max = max_flap_gate_angle
+
+    # Abfluss der Klappe, der beim Stauziel nötig ist, und Grenzen bei 0° bzw. maximalem Winkel
+    Kla_Q_SZ = Q - labyrinth_discharge_batch(Lab.Sh, UW, SZ, Lab.W, Lab.P, Lab.B, Lab.alpha, D=Lab.D,
+                                             gravity=Lab.gravity)
+    Kla_min = flap_gate_discharge_batch(Kla.Sh, UW, SZ, Kla.KW, Kla.KP, 0)
+    Kla_max = flap_gate_discharge_batch(Kla.Sh, UW, SZ, Kla.KW, Kla.KP, Klawinkel_Max)
+
+    Klappe_al = _bisektion(lambda al: flap_gate_discharge_batch(Kla.Sh, UW, SZ, Kla.KW, Kla.KP, al) - Kla_Q_SZ,
+                           np.zeros(Q.shape), np.full(Q.shape, float(Klawinkel_Max)), iterations=50)
+    Klappe_al = np.where(Kla_Q_SZ > Kla_max, Klawinkel_Max, np.where(Kla_Q_SZ < Kla_min, 0.0, Klappe_al))
+    Klappe_al = np.where(np.isfinite(Q) & np.isfinite(UW), Klappe_al, np.nan)
+
+    gehalten = (Kla_min <= Kla_Q_SZ) & (Kla_Q_SZ <= Kla_max)
+    Lab_Q = np.where(gehalten, Q - Kla_Q_SZ, np.nan)
+    Kla_Q = np.where(gehalten, Kla_Q_SZ, np.nan)
+    OW = np.where(gehalten, SZ, np.nan)
+
+    # nicht gehaltenes Stauziel: Abflussaufteilung beim gewählten Winkel
+    frei = ~gehalten & np.isfinite(Klappe_al)
+    if frei.any():
+        Lab_Q[frei], Kla_Q[frei], OW[frei] = _kopplung_batch(Lab, Kla, Q[frei], UW[frei], Klappe_al[frei])
+
+    ergebnis = {'Abfluss': Q, 'UW': UW, 'OW': OW, 'Labyrinth Q': Lab_Q, 'Klappe Q': Kla_Q, 'Klappe winkel': Klappe_al}
+
+    return result_records(ergebnis) if records else ergebnis
+
+
+# Ensemble-Rechnung (z.B. Klimaszenarien): discharge ist ein Array (Mitglieder, Zeitschritte), der Unterwasserstand
+# wird als gleich großes Array übergeben oder einmal aus discharge_vector/downstream_water_level_vector mit
+# interpolation_method angepasst (UW_fit). Alle Mitglieder werden in einem Schritt mit
+# upstream_water_level_batch berechnet, ohne Plots und Dateien. Kürzere Mitglieder können mit np.nan aufgefüllt
+# werden.
+# Rückgabe: Ergebnisse je Mitglied und Zeitschritt (MultiIndex Mitglied, Schritt), Kennwerte je Mitglied und
+# Perzentile über die Mitglieder je Zeitschritt.
+def ensemble_operational_model(labyrinth_object, discharge, downstream_water_level=None, flap_gate_opject=None,
+                               design_upstream_water_level=None, max_flap_gate_angle=None, discharge_vector=None,
+                               downstream_water_level_vector=None, interpolation_method=None,
+                               percentiles=(5, 50, 95)):
+    Q = np.atleast_2d(np.asarray(discharge, dtype=float))
+    if downstream_water_level is None:
+        UW_modell, _ = UW_fit(discharge_vector, downstream_water_level_vector, interpolation_method)
+        UW = UW_modell(Q)
+    else:
+        UW = np.broadcast_to(np.asarray(downstream_water_level, dtype=float), Q.shape)
+
+    ergebnis = upstream_water_level_batch(labyrinth_object, Q, UW, flap_gate_opject, design_upstream_water_level,
+                                          max_flap_gate_angle)
+
+    n_member, n_schritt = Q.shape
+    index = pd.MultiIndex.from_product([range(n_member), range(n_schritt)], names=['Mitglied', 'Schritt'])
+    results = pd.DataFrame({name: np.ravel(werte) for name, werte in ergebnis.items()}, index=index)
+
+    OW = ergebnis['OW']
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        kennwerte = pd.DataFrame({'Q max': np.nanmax(Q, axis=1), 'OW max': np.nanmax(OW, axis=1),
+                                  'OW Mittelwert': np.nanmean(OW, axis=1),
+                                  'Schritte': np.sum(np.isfinite(OW), axis=1)},
+                                 index=pd.Index(range(n_member), name='Mitglied'))
+        if flap_gate_opject is not None:
+            gehalten = np.isclose(OW, design_upstream_water_level)
+            kennwerte['Stauziel gehalten'] = np.sum(gehalten, axis=1) / kennwerte['Schritte']
+            kennwerte['Klappe winkel max'] = np.nanmax(ergebnis['Klappe winkel'], axis=1)
+
+        perzentile = np.nanpercentile(OW, percentiles, axis=0)
+        statistik = pd.DataFrame({'OW Mittelwert': np.nanmean(OW, axis=0)},
+                                 index=pd.Index(range(n_schritt), name='Schritt'))
+        for p, werte in zip(percentiles, perzentile):
+            statistik[f'OW P{p:g}'] = werte
+
+    return results, kennwerte, statistik
+
+
+# Histogramm mit fester Klassenbreite für Datenströme, der Wertebereich wächst bei Bedarf mit
+# (Speicherbedarf abhängig vom Wertebereich, nicht von der Anzahl der Werte)
+class _StreamingHistogram():
+
+    def __init__(self, resolution):
+        self.resolution = resolution
+        self.start = None  # Index der ersten Klasse
+        self.counts = np.zeros(0)
+
+    def add(self, werte, gewichte=None):
+        idx = np.floor(werte / self.resolution).astype(np.int64)
+        if not np.size(idx):
+            return
+        if self.start is None:
+            self.start = int(idx.min())
+        neu_start = min(self.start, int(idx.min()))
+        neu_ende = max(self.start + np.size(self.counts), int(idx.max()) + 1)
+        if neu_start < self.start or neu_ende > self.start + np.size(self.counts):
+            counts = np.zeros(neu_ende - neu_start)
+            counts[self.start - neu_start:self.start - neu_start + np.size(self.counts)] = self.counts
+            self.start, self.counts = neu_start, counts
+        self.counts += np.bincount(idx - self.start, weights=gewichte, minlength=np.size(self.counts))
+
+    # Untere Klassengrenzen und Anteil der Werte >= Klassengrenze
+    def exceedance(self):
+        unten = (self.start + np.arange(np.size(self.counts))) * self.resolution if self.start is not None else []
+        anteil = np.cumsum(self.counts[::-1])[::-1] / max(np.sum(self.counts), 1e-300)
+        return np.asarray(unten, dtype=float), anteil
+
+
+# Dauerlinien aus langen Abflussreihen (z.B. Jahrzehnte mit Tages- oder Stundenwerten), die blockweise mit
+# update(discharge, weights) übergeben werden. Jeder Abfluss wird über eine zwischengespeicherte
+# Abflusskurve des Wehrs (upstream_water_level_batch auf einem Abflussraster mit rating_stepsize, Unterwasser aus
+# UW_fit) auf den Oberwasserstand abgebildet. Das Raster wird erweitert, sobald größere Abflüsse auftreten.
+# Oberwasserstand und Abfluss werden in Histogrammen (level_resolution, discharge_resolution) gezählt, der
+# Speicherbedarf hängt nicht von der Länge der Reihe ab. weights: optionale Dauer der Zeitschritte.
+class FlowDurationStatistics():
+
+    def __init__(self, labyrinth_object, discharge_vector, downstream_water_level_vector, interpolation_method,
+                 flap_gate_opject=None, design_upstream_water_level=None, max_flap_gate_angle=None,
+                 rating_stepsize=0.01, level_resolution=0.001, discharge_resolution=0.01):
+        self.Lab = labyrinth_object
+        self.Kla = flap_gate_opject
+        self.SZ = design_upstream_water_level
+        self.Klawinkel_Max = max_flap_gate_angle
+        self.UW_modell, _ = UW_fit(discharge_vector, downstream_water_level_vector, interpolation_method)
+        self.rating_stepsize = rating_stepsize
+
+        self.Q_rating = np.zeros(0)
+        self.OW_rating = np.zeros(0)
+        self.rating(np.max(discharge_vector))
+
+        self.OW_hist = _StreamingHistogram(level_resolution)
+        self.Q_hist = _StreamingHistogram(discharge_resolution)
+        self.dauer = 0.0
+        self.dauer_gehalten = 0.0
+        self.dauer_unter = 0.0
+        self.OW_max = -np.inf
+        self.Q_max = -np.inf
+
+    # Abflusskurve bis mindestens Q_max, neue Rasterpunkte werden angehängt
+    def rating(self, Q_max):
+        if np.size(self.Q_rating) and Q_max <= self.Q_rating[-1]:
+            return
+        n_alt = np.size(self.Q_rating)
+        n_neu = int(np.ceil(max(Q_max, 1.5 * (self.Q_rating[-1] if n_alt else 0)) / self.rating_stepsize)) + 1
+        Q = np.arange(n_alt, n_neu) * self.rating_stepsize
+        OW = upstream_water_level_batch(self.Lab, Q, self.UW_modell(Q), self.Kla, self.SZ, self.Klawinkel_Max)['OW']
+        self.Q_rating = np.concatenate((self.Q_rating, Q))
+        self.OW_rating = np.concatenate((self.OW_rating, OW))
+
+    def update(self, discharge, weights=None):
+        Q = np.ravel(np.asarray(discharge, dtype=float))
+        gewichte = np.ones(np.size(Q)) if weights is None else np.ravel(np.asarray(weights, dtype=float))
+        gueltig = np.isfinite(Q)
+        Q, gewichte = np.maximum(Q[gueltig], 0), np.broadcast_to(gewichte, gueltig.shape)[gueltig]
+        if not np.size(Q):
+            return
+
+        self.rating(np.max(Q))
+        OW = np.interp(Q, self.Q_rating, self.OW_rating)
+
+        self.OW_hist.add(OW, gewichte)
+        self.Q_hist.add(Q, gewichte)
+        self.dauer += np.sum(gewichte)
+        if self.SZ is not None:
+            self.dauer_gehalten += np.sum(gewichte[np.abs(OW - self.SZ) <= 1e-6])
+            self.dauer_unter += np.sum(gewichte[OW < self.SZ - 1e-6])
+        self.OW_max = max(self.OW_max, np.max(OW))
+        self.Q_max = max(self.Q_max, np.max(Q))
+
+    # Überschreitungsdauerlinie des Oberwasserstands
+    def exceedance(self):
+        OW, anteil = self.OW_hist.exceedance()
+        return pd.DataFrame({'OW': OW, 'Überschreitungsdauer': anteil})
+
+    # Abflussdauerlinie
+    def flow_duration(self):
+        Q, anteil = self.Q_hist.exceedance()
+        return pd.DataFrame({'Abfluss': Q, 'Überschreitungsdauer': anteil})
+
+    def summary(self):
+        kennwerte = {'Dauer': self.dauer, 'Q max': self.Q_max, 'OW max': self.OW_max}
+        if self.SZ is not None:
+            kennwerte['Stauziel gehalten'] = self.dauer_gehalten / self.dauer
+            kennwerte['unter Stauziel'] = self.dauer_unter / self.dauer
+            kennwerte['über Stauziel'] = 1 - (self.dauer_gehalten + self.dauer_unter) / self.dauer
+        return kennwerte
+
+
+# Klappenwinkel für einen Teil der Unterwasserstände der Steuertabelle (eigene Funktion für den Prozesspool)
+def _steuertabelle(labyrinth_object, flap_gate_opject, design_upstream_water_level, max_flap_gate_angle, Q_grid,
+                   UW_grid):
+    Q, UW = np.meshgrid(Q_grid, UW_grid)
+    return upstream_water_level_batch(labyrinth_object, Q, UW, flap_gate_opject, design_upstream_water_level,
+                                      max_flap_gate_angle)['Klappe winkel']
+
+
+# Vorberechnete Steuertabelle (Abfluss, Unterwasser) -> Klappenwinkel, der das Stauziel hält (wie
+# upstream_water_level_batch), für den Betrieb ohne Optimierung.
+# discharge_grid und downstream_water_level_grid müssen gleichabständig sein (z.B. np.linspace), die Tabelle
+# wird zeilenweise (je Unterwasserstand) mit max_workers Prozessen berechnet (None/1: ohne Prozesspool).
+# Der Winkel wird je Unterwasserstand monoton steigend im Abfluss gemacht (laufendes Maximum, die größte
+# Korrektur steht in monotonie_korrektur) und als float32 gespeichert. Die bilineare Interpolation ist damit
+# ebenfalls monoton im Abfluss. Außerhalb des Rasters wird auf den Rand begrenzt.
+# lookup(Q, UW) ist der schnelle Zugriff für einzelne Werte (Python-Floats, O(1)), der Aufruf des Objekts
+# rechnet Arrays.
+class FlapControlTable():
+
+    def __init__(self, labyrinth_object=None, flap_gate_opject=None, design_upstream_water_level=None,
+                 max_flap_gate_angle=None, discharge_grid=None, downstream_water_level_grid=None, max_workers=None):
+        if labyrinth_object is None:  # für load
+            return
+
+        Q_grid = np.asarray(discharge_grid, dtype=float)
+        UW_grid = np.asarray(downstream_water_level_grid, dtype=float)
+        for name, raster in (('discharge_grid', Q_grid), ('downstream_water_level_grid', UW_grid)):
+            if np.size(raster) < 2 or not np.allclose(np.diff(raster), raster[1] - raster[0]) or raster[1] <= raster[0]:
+                raise ValueError(f"{name} muss gleichabständig und steigend sein (mindestens 2 Werte).")
+
+        argumente = (labyrinth_object, flap_gate_opject, design_upstream_water_level, max_flap_gate_angle, Q_grid)
+        if max_workers is None or max_workers == 1:
+            winkel = _steuertabelle(*argumente, UW_grid)
+        else:
+            teile = np.array_split(UW_grid, min(max_workers, np.size(UW_grid)))
+            with ProcessPoolExecutor(max_workers) as pool:
+                winkel = np.vstack(list(pool.map(_steuertabelle, *([a] * len(teile) for a in argumente), teile)))
+
+        monoton = np.maximum.accumulate(winkel, axis=1)
+        self.monotonie_korrektur = float(np.max(monoton - winkel))
+        self.max_flap_gate_angle = float(max_flap_gate_angle)
+        self.setze(Q_grid[0], Q_grid[1] - Q_grid[0], UW_grid[0], UW_grid[1] - UW_grid[0], monoton)
+
+    def setze(self, Q0, dQ, UW0, dUW, winkel):
+        self.Q0, self.dQ, self.UW0, self.dUW = float(Q0), float(dQ), float(UW0), float(dUW)
+        self.winkel = np.asarray(winkel, dtype=np.float32)
+        self.n_UW, self.n_Q = self.winkel.shape
+        self._werte = self.winkel.ravel().tolist()
+
+    def __call__(self, discharge, downstream_water_level):
+        x = np.clip((np.asarray(discharge, dtype=float) - self.Q0) / self.dQ, 0, self.n_Q - 1)
+        y = np.clip((np.asarray(downstream_water_level, dtype=float) - self.UW0) / self.dUW, 0, self.n_UW - 1)
+        i = np.minimum(x.astype(int), self.n_Q - 2)
+        j = np.minimum(y.astype(int), self.n_UW - 2)
+        fx, fy = x - i, y - j
+        w = self.winkel
+
+        return ((1 - fy) * ((1 - fx) * w[j, i] + fx * w[j, i + 1])
+                + fy * ((1 - fx) * w[j + 1, i] + fx * w[j + 1, i + 1]))
+
+    def lookup(self, discharge, downstream_water_level):
+        x = (discharge - self.Q0) / self.dQ
+        y = (downstream_water_level - self.UW0) / self.dUW
+        x = 0.0 if x < 0 else min(x, self.n_Q - 1.0)
+        y = 0.0 if y < 0 else min(y, self.n_UW - 1.0)
+        i = min(int(x), self.n_Q - 2)
+        j = min(int(y), self.n_UW - 2)
+        fx, fy = x - i, y - j
+        k = j * self.n_Q + i
+        w = self._werte
+
+        return ((1 - fy) * ((1 - fx) * w[k] + fx * w[k + 1])
+                + fy * ((1 - fx) * w[k + self.n_Q] + fx * w[k + self.n_Q + 1]))
+
+    def save(self, path):
+        np.savez_compressed(path, winkel=self.winkel, raster=np.array([self.Q0, self.dQ, self.UW0, self.dUW]),
+                            monotonie_korrektur=self.monotonie_korrektur, max_flap_gate_angle=self.max_flap_gate_angle)
+
+    @classmethod
+    def load(cls, path):
+        tabelle = cls()
+        with np.load(path) as daten:
+            tabelle.setze(*daten['raster'], daten['winkel'])
+            tabelle.monotonie_korrektur = float(daten['monotonie_korrektur'])
+            tabelle.max_flap_gate_angle = float(daten['max_flap_gate_angle'])
+
+        return tabelle
+
+
+# Pegeldaten (Zeitstempel, Abfluss, Unterwasser) für ControlLoopSimulator aus einer lokalen Datei oder einem
+# asyncio.StreamReader (z.B. Socket). Trennzeichen ; , oder Leerzeichen, Zeitstempel in Sekunden oder als
+# Datum/Uhrzeit. Zeilen, die sich nicht lesen lassen (Kopfzeile, Kommentare), werden übersprungen.
+async def gauge_readings(source):
+    def lesen(zeile):
+        teile = re.split(r'[;,\s]+', zeile.strip())
+        if len(teile) < 3:
+            return None
+        try:
+            Q, UW = float(teile[1]), float(teile[2])
+        except ValueError:
+            return None
+        try:
+            t = float(teile[0])
+        except ValueError:
+            try:
+                t = pd.Timestamp(teile[0]).timestamp()
+            except ValueError:
+                return None
+        return t, Q, UW
+
+    if isinstance(source, asyncio.StreamReader):
+        while True:
+            zeile = await source.readline()
+            if not zeile:
+                break
+            messung = lesen(zeile.decode())
+            if messung is not None:
+                yield messung
+    else:
+        with open(source, encoding='utf-8') as datei:
+            for zeile in datei:
+                messung = lesen(zeile)
+                if messung is not None:
+                    yield messung
+
+
+# Simulation der Klappensteuerung mit Pegeldaten, schneller als Echtzeit.
+# Sollwinkel aus der Steuertabelle (FlapControlTable), der Antrieb folgt mit höchstens rate_limit [°/s] und
+# bewegt sich nur, wenn die Abweichung größer als deadband [°] ist. Der Oberwasserstand beim tatsächlichen
+# Winkel kommt aus einer vorab berechneten Schlüsselkurve (Abfluss, Unterwasser, Winkel) -> Oberwasser
+# (_kopplung_batch, trilinear interpoliert), quasistationär ohne Speicherwirkung des Stauraums.
+# Es wird also weder kopplung noch eine Optimierung je Zeitschritt aufgerufen. 'OW Soll' im Protokoll ist der
+# Oberwasserstand beim Sollwinkel, die Differenz zu 'OW' die Regelabweichung durch Antrieb und Totband.
+class ControlLoopSimulator():
+
+    def __init__(self, control_table, labyrinth_object, flap_gate_opject, design_upstream_water_level,
+                 rate_limit=1.0, deadband=0.5, initial_angle=None, n_discharge=61, n_downstream_water_level=31,
+                 angle_stepsize=2):
+        self.tabelle = control_table
+        self.SZ = design_upstream_water_level
+        self.rate_limit = rate_limit
+        self.deadband = deadband
+        self.initial_angle = initial_angle
+
+        # Schlüsselkurve Oberwasser über dem Bereich der Steuertabelle
+        T = control_table
+        Q_grid = np.linspace(T.Q0, T.Q0 + T.dQ * (T.n_Q - 1), n_discharge)
+        UW_grid = np.linspace(T.UW0, T.UW0 + T.dUW * (T.n_UW - 1), n_downstream_water_level)
+        al_grid = np.append(np.arange(0, T.max_flap_gate_angle, angle_stepsize), T.max_flap_gate_angle)
+        Q, UW, al = np.meshgrid(Q_grid, UW_grid, al_grid, indexing='ij')
+        OW = _kopplung_batch(labyrinth_object, flap_gate_opject, Q.ravel(), UW.ravel(), al.ravel())[2]
+
+        self._raster = [(float(g[0]), float(g[1] - g[0]), np.size(g)) for g in (Q_grid, UW_grid, al_grid)]
+        self._al_grid = al_grid
+        self._OW = OW.reshape(Q.shape).ravel().tolist()
+
+    # Oberwasser aus der Schlüsselkurve, trilinear (Werte außerhalb werden auf den Rand begrenzt)
+    def upstream_water_level(self, discharge, downstream_water_level, angle):
+        index, anteil = [], []
+        for wert, (start, schritt, n) in zip((discharge, downstream_water_level, angle), self._raster):
+            x = (wert - start) / schritt
+            x = 0.0 if x < 0 else min(x, n - 1.0)
+            i = min(int(x), n - 2)
+            index.append(i)
+            anteil.append(x - i)
+        (i, j, k), (fx, fy, fz) = index, anteil
+        n_UW, n_al = self._raster[1][2], self._raster[2][2]
+        w = self._OW
+
+        ergebnis = 0.0
+        for di, gx in ((0, 1 - fx), (1, fx)):
+            for dj, gy in ((0, 1 - fy), (1, fy)):
+                m = ((i + di) * n_UW + j + dj) * n_al + k
+                ergebnis += gx * gy * ((1 - fz) * w[m] + fz * w[m + 1])
+
+        return ergebnis
+
+    # readings: asynchroner Iterator über (Zeitstempel [s], Abfluss, Unterwasser), Dateiname oder StreamReader.
+    # speed=None: so schnell wie möglich, sonst Zeitraffer-Faktor gegenüber den Zeitstempeln.
+    # Rückgabe: Protokoll je Schritt und Kennwerte (Schritte/s, Latenz je Schritt, Abweichung vom Stauziel).
+    async def run(self, readings, speed=None):
+        if isinstance(readings, (str, os.PathLike, asyncio.StreamReader)):
+            readings = gauge_readings(readings)
+
+        loop = asyncio.get_running_loop()
+        protokoll = []
+        winkel = self.initial_angle
+        t_alt = None
+        start = time.perf_counter()
+
+        async for t, Q, UW in readings:
+            empfangen = time.perf_counter()
+
+            soll = self.tabelle.lookup(Q, UW)
+            if winkel is None:
+                winkel = soll
+            elif t_alt is not None and abs(soll - winkel) > self.deadband:
+                # erste Messung mit initial_angle: noch keine Zeit vergangen, die Klappe steht
+                schritt = self.rate_limit * (t - t_alt)
+                winkel = winkel + max(-schritt, min(schritt, soll - winkel))
+            OW = self.upstream_water_level(Q, UW, winkel)
+            OW_soll = self.upstream_water_level(Q, UW, soll)
+
+            fertig = time.perf_counter()
+            protokoll.append((t, Q, UW, soll, winkel, OW, OW_soll, (fertig - empfangen) * 1e6))
+            t_alt = t
+
+            if speed:
+                if len(protokoll) == 1:
+                    t_start, start_loop = t, loop.time()
+                await asyncio.sleep(max(0.0, start_loop + (t - t_start) / speed - loop.time()))
+            elif len(protokoll) % 1000 == 0:
+                await asyncio.sleep(0)
+
+        dauer = time.perf_counter() - start
+        log = pd.DataFrame(protokoll, columns=['Zeit', 'Abfluss', 'UW', 'Sollwinkel', 'Klappe winkel', 'OW',
+                                               'OW Soll', 'Latenz [us]'])
+        latenz = log['Latenz [us]'].to_numpy()
+        kennwerte = {'Schritte': len(log),
+                     'Schritte/s': len(log) / dauer if dauer > 0 else np.nan,
+                     'Latenz Mittel [us]': float(np.mean(latenz)) if len(log) else np.nan,
+                     'Latenz p99 [us]': float(np.percentile(latenz, 99)) if len(log) else np.nan,
+                     'Latenz max [us]': float(np.max(latenz)) if len(log) else np.nan,
+                     'Regelabweichung max [m]': float(np.max(np.abs(log['OW'] - log['OW Soll']))) if len(log) else np.nan}
+
+        return log, kennwerte
+
+
+# Ein Szenario für ScenarioPool, eigene Funktion damit sie im Prozesspool ausgeführt werden kann.
+# Plots und Dateiausgabe sind aus, solange sie im Szenario nicht ausdrücklich eingeschaltet werden.
+def _scenario(scenario):
+    return operational_model(**dict({'show_plot': False, 'save_plot': False, 'write_files': False}, **scenario))
+
+
+# Asynchrone Berechnung vieler operational_model-Szenarien in einem Prozesspool, z.B. für einen Planungsdienst:
+#     async with ScenarioPool(max_workers=4) as pool:
+#         future = await pool.submit(labyrinth_object=Lab, discharge_vector=Q, ...)
+#         results, results_events = await future
+# submit wartet, solange max_pending Szenarien in Bearbeitung sind (Gegendruck), und gibt dann ein awaitable
+# Future zurück. Abbrechen (future.cancel()) entfernt ein wartendes Szenario aus dem Pool, ein laufendes wird zu
+# Ende gerechnet und das Ergebnis verworfen.
+class ScenarioPool():
+
+    def __init__(self, max_workers=None, max_pending=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.max_workers
+        self._executor = None
+        self._platz = None
+        self._futures = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close(cancel=exc_type is not None)
+
+    async def submit(self, **scenario):
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.max_workers)
+            self._platz = asyncio.Semaphore(self.max_pending)
+
+        await self._platz.acquire()
+        try:
+            auftrag = self._executor.submit(_scenario, scenario)
+        except BaseException:
+            self._platz.release()
+            raise
+
+        # der Platz wird erst frei, wenn der Prozess das Szenario abgeschlossen oder nie begonnen hat
+        auftrag.add_done_callback(lambda _: loop.call_soon_threadsafe(self._platz.release))
+        future = asyncio.wrap_future(auftrag)
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+
+        return future
+
+    async def run(self, **scenario):
+        return await (await self.submit(**scenario))
+
+    # cancel=True bricht alle noch nicht begonnenen Szenarien ab
+    async def close(self, cancel=False):
+        if cancel:
+            for future in list(self._futures):
+                future.cancel()
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+
+
+# Kleinster Index j in [0, n] mit wert(j) >= 0 für in j monoton steigende Werte (vektorisierte binäre Suche),
+# n wenn kein Wert >= 0 ist
+def _erster_index(wert, n, shape):
+    lo = np.zeros(shape, dtype=int)
+    hi = np.full(shape, n)
+
+    while (lo < hi).any():
+        offen = lo < hi
+        mid = (lo + hi) // 2
+        ok = wert(np.minimum(mid, n - 1)) >= 0
+        hi = np.where(offen & ok, mid, hi)
+        lo = np.where(offen & ~ok, mid + 1, lo)
+
+    return lo
+
+
+# Gemeinsame Optimierung von Labyrinth-Wehr (B, alpha) und Klappe (Breite, Höhe, maximaler Winkel) für den
+# Betrieb wie in operational_model. Kriterien je Entwurf (Kombination Labyrinth x Klappe):
+# - Stauziel Anteil: Anteil der Abflüsse (Raster wie in operational_model, gewichtet mit duration_weights einer
+#   Abflusszeitreihe discharge_series), bei denen das Stauziel gehalten wird, d.h. es gibt einen Klappenwinkel
+#   zwischen 0 und dem maximalen Winkel mit Q_Labyrinth(Stauziel) + Q_Klappe(Stauziel, Winkel) = Q.
+# - FAA/FAbA Anteil: Anteil der Abflüsse, bei denen das Stauziel gehalten wird und die Klappe mit dem dafür
+#   nötigen (kleinsten) Winkel die Kriterien aus check_FAA_FAbA für alle fish_names erfüllt: Beschleunigung,
+#   Klappenbreite Ebel und DWA, Überfallhöhe, Einleitung und Fließgeschwindigkeit (nur mit
+#   Bemessungsgeschwindigkeit). Eintauchgeschwindigkeit und Wasserpolster hängen beim gehaltenen Stauziel nicht
+#   vom Entwurf ab und werden nicht geprüft.
+# - OW max: Oberwasserstand beim größten Abfluss mit der Klappe im maximalen Winkel, optional begrenzt durch
+#   max_upstream_water_level.
+# Die Abflussaufteilung wird nicht je Entwurf mit kopplung gelöst, sondern aus Abflusstabellen der Bauwerke bei
+# festem Oberwasserstand zusammengesetzt (labyrinth_discharge_batch, flap_gate_discharge_batch): beim Stauziel
+# je Labyrinth und Abfluss bzw. je Klappe, Abfluss und Winkel (n_angles Winkel zwischen 0 und dem maximalen
+# Winkel), für OW max je Bauwerk auf einem gemeinsamen Wasserstandsraster (n_levels). Die Entwürfe werden
+# blockweise (chunk_size Tabellenwerte) per binärer Suche in der Summe der Tabellen ausgewertet.
+# Rangfolge: FAA/FAbA Anteil, Stauziel Anteil (jeweils absteigend), OW max (aufsteigend).
+# Rückgabe: Labyrinth- und FlapGate-Objekt des besten Entwurfs beim größten Abfluss (Klappe im maximalen Winkel),
+# die top_k Entwürfe stehen in bestLab.top_designs, die Statistik in bestLab.optimization_stats.
+# Ohne zulässigen Entwurf (None, None).
+def optimize_labyrinth_flap_gate(sohleHoehe, discharge_vector, downstream_water_level_vector, interpolation_method,
+                                 design_upstream_water_level, labyrinthBreite, labyrinthHoehe, labyrinthLaengeMax,
+                                 flap_gate_width_vector, flap_gate_height_vector, max_flap_gate_angle_vector,
+                                 B_vector=None, Angle_vector=None, D=0.3, interpolation_stepsize=1,
+                                 discharge_series=None, fish_names=None, Bemessungsgeschwindigkeit=None,
+                                 max_upstream_water_level=None, n_angles=91, n_levels=200, top_k=10,
+                                 chunk_size=2000000, path=''):
+    SZ = design_upstream_water_level
+    g = 9.81
+
+    # Abflussraster und Unterwasser wie in operational_model
+    UW_modell, _ = UW_fit(discharge_vector, downstream_water_level_vector, interpolation_method)
+    Q_con = np.arange(np.min(discharge_vector), np.max(discharge_vector) + interpolation_stepsize,
+                      interpolation_stepsize)
+    UW_con = UW_modell(Q_con)
+    Q_max = float(np.max(discharge_vector))
+    UW_max = float(UW_modell(Q_max))
+    if discharge_series is None:
+        gewichte = np.full(np.size(Q_con), 1 / np.size(Q_con))
+    else:
+        gewichte = duration_weights(Q_con, discharge_series)
+
+    # Entwurfsraum Labyrinth (B, alpha) und Klappe (KW, KP, maximaler Winkel)
+    B_vector = np.arange(1, labyrinthLaengeMax + 0.1, 0.1) if B_vector is None else np.asarray(B_vector, float)
+    Angle_vector = np.arange(6, 36, 1) if Angle_vector is None else np.asarray(Angle_vector, float)
+    Lab_B, Lab_alpha = (x.ravel() for x in np.meshgrid(B_vector, Angle_vector, indexing='ij'))
+    KW, KP, Kmax = (x.ravel() for x in np.meshgrid(*(np.atleast_1d(np.asarray(v, dtype=float)) for v in (
+        flap_gate_width_vector, flap_gate_height_vector, max_flap_gate_angle_vector)), indexing='ij'))
+    n_lab, n_kla, n_Q = np.size(Lab_B), np.size(KW), np.size(Q_con)
+
+    # Abflusstabellen beim Stauziel: Labyrinth (n_lab, n_Q), Klappe (n_kla, n_Q, n_angles)
+    Lab_SZ = labyrinth_discharge_batch(sohleHoehe, UW_con, SZ, labyrinthBreite, labyrinthHoehe, Lab_B[:, None],
+                                       Lab_alpha[:, None], D=D)
+    winkel = Kmax[:, None, None] * np.linspace(0, 1, n_angles)
+    Kla_SZ = flap_gate_discharge_batch(sohleHoehe, UW_con[:, None], SZ, KW[:, None, None], KP[:, None, None], winkel)
+    Kla_SZ_min = Kla_SZ.min(axis=2)
+    Kla_SZ_max = Kla_SZ.max(axis=2)
+    Kla_SZ_kum = np.maximum.accumulate(Kla_SZ, axis=2)
+
+    # Fischkriterien je Klappe, Abfluss und Winkel wie in check_FAA_FAbA
+    # (nicht endliche Werte sind wie dort nicht anwendbar und gelten als erfüllt)
+    if fish_names is None:
+        fish_names = []
+    fisch_hohe = np.array([fish_arten_DWA[name][1] for name in fish_names if name in fish_arten_DWA])
+    fisch_dicke = np.array([fish_arten_DWA[name][2] for name in fish_names if name in fish_arten_DWA])
+    min_bypass_breite = np.array([fish_arten_Ebel[name] for name in fish_names if name in fish_arten_Ebel])
+
+    P_neu = KP[:, None, None] * np.cos(np.radians(winkel))
+    h_uw = (UW_con - sohleHoehe)[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hu = SZ - sohleHoehe - P_neu
+        v = Kla_SZ / (KW[:, None, None] * hu)
+        v_gr = np.power(g * np.power(np.power(Kla_SZ / KW[:, None, None], 2) / g, 0.33), 0.5)
+        beschleunigung = (v_gr - v) / (KP[:, None, None] * np.sin(np.radians(winkel)))
+
+        fisch_ok = ~np.isfinite(beschleunigung) | (beschleunigung <= 1)
+        fisch_ok &= h_uw + 0.5 >= P_neu
+        if np.size(fisch_hohe):
+            fisch_ok &= hu >= 3 * np.max(fisch_hohe)
+        if Bemessungsgeschwindigkeit is not None:
+            v_FAbA = Kla_SZ / (h_uw * KW[:, None, None])
+            fisch_ok &= ~np.isfinite(v_FAbA) | (Bemessungsgeschwindigkeit >= v_FAbA)
+
+    breite_ok = np.ones(n_kla, dtype=bool)
+    if np.size(min_bypass_breite):
+        breite_ok &= KW >= np.max(min_bypass_breite)
+    if np.size(fisch_dicke):
+        breite_ok &= KW >= 9 * np.max(fisch_dicke)
+    fisch_ok &= breite_ok[:, None, None]
+
+    # Abflusstabellen für OW max auf einem gemeinsamen Wasserstandsraster
+    Lab_frei = labyrinth_batch(sohleHoehe, UW_max, Q_max, labyrinthBreite, labyrinthHoehe, Lab_B, Lab_alpha, D=D)['yu']
+    Kla_frei = flap_gate_batch(sohleHoehe, UW_max, Q_max, KW, KP, Kmax)['yu']
+    y_min = min(sohleHoehe + labyrinthHoehe, np.min(sohleHoehe + KP * np.cos(np.radians(Kmax))))
+    y_max = min(np.nanmax(Lab_frei), np.nanmax(Kla_frei)) + 0.01
+    y = np.linspace(y_min, y_max, n_levels)
+    Lab_y = np.maximum.accumulate(labyrinth_discharge_batch(sohleHoehe, UW_max, y, labyrinthBreite, labyrinthHoehe,
+                                                            Lab_B[:, None], Lab_alpha[:, None], D=D), axis=1)
+    Kla_y = np.maximum.accumulate(flap_gate_discharge_batch(sohleHoehe, UW_max, y, KW[:, None], KP[:, None],
+                                                            Kmax[:, None]), axis=1)
+
+    stauziel = np.empty((n_lab, n_kla))
+    fisch = np.empty((n_lab, n_kla))
+    Q_von = np.empty((n_lab, n_kla))
+    Q_bis = np.empty((n_lab, n_kla))
+    OW_max = np.empty((n_lab, n_kla))
+
+    k_idx = np.arange(n_kla)[None, :, None]
+    Q_idx = np.arange(n_Q)[None, None, :]
+    block = max(1, chunk_size // (n_kla * max(n_Q, n_levels)))
+
+    for start in range(0, n_lab, block):
+        l = slice(start, min(start + block, n_lab))
+
+        # gehaltenes Stauziel und Klappenwinkel (Index im Winkelraster) je Labyrinth, Klappe und Abfluss
+        Q_kla = (Q_con - Lab_SZ[l])[:, None, :]
+        gehalten = (Kla_SZ_min[None] <= Q_kla) & (Q_kla <= Kla_SZ_max[None])
+        j = _erster_index(lambda j: Kla_SZ_kum[k_idx, Q_idx, j] - Q_kla, n_angles, gehalten.shape)
+        ok = gehalten & fisch_ok[k_idx, Q_idx, np.minimum(j, n_angles - 1)]
+
+        stauziel[l] = np.sum(gehalten * gewichte, axis=2)
+        fisch[l] = np.sum(ok * gewichte, axis=2)
+        Q_von[l] = np.min(np.where(gehalten, Q_con, np.inf), axis=2)
+        Q_bis[l] = np.max(np.where(gehalten, Q_con, -np.inf), axis=2)
+
+        # OW max: erster Wasserstand mit Q_Labyrinth + Q_Klappe >= Q_max, linear interpoliert
+        L_y = Lab_y[l][:, None, :]
+        K_y = Kla_y[None, :, :]
+        i_l = np.arange(np.shape(L_y)[0])[:, None]
+        i_k = np.arange(n_kla)[None, :]
+        j = _erster_index(lambda j: L_y[i_l, 0, j] + K_y[0, i_k, j] - Q_max, n_levels, (np.shape(L_y)[0], n_kla))
+        j0, j1 = np.maximum(j - 1, 0), np.minimum(j, n_levels - 1)
+        Q0 = L_y[i_l, 0, j0] + K_y[0, i_k, j0]
+        Q1 = L_y[i_l, 0, j1] + K_y[0, i_k, j1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            anteil = np.clip(np.where(Q1 > Q0, (Q_max - Q0) / (Q1 - Q0), 0), 0, 1)
+        OW_max[l] = np.where(j < n_levels, y[j0] + anteil * (y[j1] - y[j0]), np.nan)
+
+    Q_von[~np.isfinite(Q_von)] = np.nan
+    Q_bis[~np.isfinite(Q_bis)] = np.nan
+
+    # Zulässigkeit und Rangfolge
+    zulaessig = np.isfinite(OW_max)
+    ausgeschlossen = {'OW max nicht bestimmbar': int(np.sum(~zulaessig))}
+    if max_upstream_water_level is not None:
+        OW_ok = ~(OW_max > max_upstream_water_level)
+        ausgeschlossen['max OW'] = int(np.sum(zulaessig & ~OW_ok))
+        zulaessig &= OW_ok
+
+    stats = {'Labyrinth Geometrien': n_lab, 'Klappen': n_kla, 'Entwürfe': n_lab * n_kla, 'Abflüsse': n_Q,
+             'ausgeschlossen': ausgeschlossen, 'zulässig': int(np.sum(zulaessig))}
+
+    if not zulaessig.any():
+        print('Kein zulässiger Entwurf gefunden.')
+        return None, None
+
+    index = np.flatnonzero(zulaessig)
+    reihenfolge = np.lexsort((index, OW_max.ravel()[index], -stauziel.ravel()[index], -fisch.ravel()[index]))
+    index = index[reihenfolge][:top_k]
+    i_lab, i_kla = np.unravel_index(index, (n_lab, n_kla))
+
+    geo = labyrinth_geometry_batch(labyrinthBreite, Lab_B[i_lab], Lab_alpha[i_lab], D)
+    top_designs = pd.DataFrame({
+        'B': Lab_B[i_lab], 'alpha': Lab_alpha[i_lab], 'D': D, 'N': geo['N'], 'w': geo['w'], 'L': geo['L'],
+        'KW': KW[i_kla], 'KP': KP[i_kla], 'Klappe Winkel max': Kmax[i_kla],
+        'FAA/FAbA Anteil': fisch.ravel()[index], 'Stauziel Anteil': stauziel.ravel()[index],
+        'Q Stauziel von': Q_von.ravel()[index], 'Q Stauziel bis': Q_bis.ravel()[index],
+        'OW max': OW_max.ravel()[index]})
+
+    # Objekte des besten Entwurfs mit der Abflussaufteilung beim größten Abfluss
+    best = top_designs.iloc[0]
+    Kla_Q = float(flap_gate_discharge_batch(sohleHoehe, UW_max, best['OW max'], best['KW'], best['KP'],
+                                            best['Klappe Winkel max']))
+    Kla_Q = min(Kla_Q, Q_max)
+    bestLab = Labyrinth(sohleHoehe, UW_max, Q_max - Kla_Q, labyrinthBreite, labyrinthHoehe, best['B'],
+                        best['alpha'], path, D=D, skip_zero_check=Q_max - Kla_Q <= 0)
+    bestKla = FlapGate(sohleHoehe, UW_max, Kla_Q, best['KW'], best['KP'], best['Klappe Winkel max'],
+                       skip_zero_check=Kla_Q <= 0)
+    bestLab.top_designs = top_designs
+    bestLab.optimization_stats = stats
+
+    return bestLab, bestKla
+
+
+# Ein Block der Monte-Carlo-Simulation, eigene Funktion damit sie im Prozesspool ausgeführt werden kann
+def _monte_carlo_batch(aufgabe):
+    rng = np.random.default_rng(aufgabe['seed'])
+    n = aufgabe['n']
+    Q_con = aufgabe['Q_con']
+    n_Q = np.size(Q_con)
+
+    geometrie = dict(aufgabe['geometrie'])
+    for name, std in aufgabe['geometry_std'].items():
+        geometrie[name] = geometrie[name] + std * rng.standard_normal((n, 1))
+
+    faktoren = 1 + aufgabe['coefficient_std'] * rng.standard_normal((n, 1, 4))
+    Q = Q_con * (1 + aufgabe['discharge_std'] * rng.standard_normal((n, n_Q)))
+    UW = np.interp(Q, aufgabe['Q_tab'], aufgabe['UW_tab']) + aufgabe['UW_std'] * rng.standard_normal((n, n_Q))
+
+    ergebnis = labyrinth_batch(geometrie['Sh'], UW, Q, geometrie['W'], geometrie['P'], geometrie['B'],
+                               geometrie['alpha'], D=geometrie['D'], coefficient_factors=faktoren)
+
+    return ergebnis['yu'].astype(np.float32)
+
+
+# Monte-Carlo-Simulation des Oberwasserstands für ein Labyrinth-Wehr.
+# Berücksichtigt werden Unsicherheiten der Konstanten a, b, c, d nach Crookston & Tullis (relative
+# Standardabweichung coefficient_std), die Streuung der Unterwasserkurve um UW_fit (UW_std [m], Standard:
+# Standardabweichung der Residuen), des Abflusses (relative Standardabweichung discharge_std) und Bautoleranzen
+# der Geometrie (geometry_std, z.B. {'P': 0.01, 'B': 0.02} in [m] bzw. [°]).
+# Die Stichproben werden in Blöcken von batch_size vektorisiert berechnet, bei n_jobs > 1 in einem Prozesspool.
+# Jeder Block hat einen eigenen Seed aus np.random.SeedSequence(seed), das Ergebnis ist daher unabhängig von n_jobs.
+def monte_carlo_upstream_water_level(labyrinth_object, discharge_vector, downstream_water_level_vector,
+                                     interpolation_method, Q_con=None, n_samples=100000, coefficient_std=0.05,
+                                     UW_std=None, discharge_std=0.0, geometry_std=None, percentiles=(5, 50, 95),
+                                     batch_size=10000, n_jobs=1, seed=None, return_samples=False):
+    discharge_vector = np.asarray(discharge_vector, dtype=float)
+    downstream_water_level_vector = np.asarray(downstream_water_level_vector, dtype=float)
+    Q_con = discharge_vector if Q_con is None else np.asarray(Q_con, dtype=float)
+
+    UW_model, R_squared = UW_fit(discharge_vector, downstream_water_level_vector, interpolation_method)
+    if UW_std is None:
+        UW_std = np.std(downstream_water_level_vector - UW_model(discharge_vector), ddof=1)
+
+    # Unterwasserkurve als Tabelle, damit sie an die Prozesse übergeben werden kann
+    Q_tab = np.linspace(0, 2 * np.max(Q_con), 2049)
+    UW_tab = UW_model(Q_tab)
+
+    geometrie = {'Sh': labyrinth_object.Sh, 'W': labyrinth_object.W, 'P': labyrinth_object.P,
+                 'B': labyrinth_object.B, 'alpha': labyrinth_object.alpha, 'D': labyrinth_object.D}
+    geometry_std = dict(geometry_std or {})
+    for name in geometry_std:
+        if name not in geometrie:
+            raise ValueError(f"Unbekannter Geometrieparameter '{name}', möglich sind {list(geometrie)}.")
+
+    n_batches = int(np.ceil(n_samples / batch_size))
+    seeds = np.random.SeedSequence(seed).spawn(n_batches)
+    aufgaben = [{'seed': seeds[k], 'n': min(batch_size, n_samples - k * batch_size), 'Q_con': Q_con,
+                 'Q_tab': Q_tab, 'UW_tab': UW_tab, 'UW_std': UW_std, 'discharge_std': discharge_std,
+                 'coefficient_std': np.broadcast_to(np.asarray(coefficient_std, dtype=float), (4,)),
+                 'geometrie': geometrie, 'geometry_std': geometry_std} for k in range(n_batches)]
+
+    if n_jobs == 1:
+        yu = [_monte_carlo_batch(aufgabe) for aufgabe in aufgaben]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            yu = list(executor.map(_monte_carlo_batch, aufgaben))
+    yu = np.concatenate(yu, axis=0)
+
+    deterministisch = labyrinth_batch(geometrie['Sh'], UW_model(Q_con), Q_con, geometrie['W'], geometrie['P'],
+                                      geometrie['B'], geometrie['alpha'], D=geometrie['D'])['yu']
+
+    ergebnis = pd.DataFrame({'Abfluss': Q_con, 'OW deterministisch': deterministisch,
+                             'OW Mittelwert': np.nanmean(yu, axis=0, dtype=float),
+                             'OW Standardabweichung': np.nanstd(yu, axis=0, dtype=float)})
+    perzentile = np.nanpercentile(yu, percentiles, axis=0) if np.isnan(yu).any() else np.percentile(yu, percentiles, axis=0)
+    for p, werte in zip(percentiles, perzentile):
+        ergebnis['OW P%g' % p] = werte
+    ergebnis['gültige Stichproben'] = np.sum(np.isfinite(yu), axis=0)
+
+    if return_samples:
+        return ergebnis, yu
+
+    return ergebnis
+
+
+# Parameter der Sensitivitätsanalyse und ihre Argumentnamen in labyrinth_batch
+sobol_parameter = {'B': 'labyrinth_length', 'alpha': 'labyrinth_key_angle', 'D': 'D', 't': 't',
+                   'P': 'labyrinth_height', 'W': 'labyrinth_width'}
+
+
+# Globale Sensitivitätsanalyse (Sobol-Indizes) von hu bzw. yu bezüglich der Geometrie.
+# bounds: Wertebereiche der variierten Parameter, z.B. {'B': (4, 8), 'alpha': (6, 35), 'P': (2.0, 2.4)},
+# alle anderen Parameter werden aus labyrinth_object übernommen. Ohne discharge_vector wird nur der
+# Abfluss des Objekts (Bemessungsabfluss) betrachtet.
+# Stichprobe nach Saltelli mit einer Sobol-Folge (scipy.stats.qmc), Schätzer erster Ordnung nach Saltelli (2010),
+# Totaleffekte nach Jansen (1999), Konfidenzintervalle per Bootstrap. Die Stichprobe wird in Blöcken von
+# chunk_size Zeilen erzeugt und ausgewertet, gespeichert werden nur die Modellergebnisse.
+def sobol_sensitivity(labyrinth_object, bounds, discharge_vector=None, downstream_water_level_vector=None,
+                      output='yu', n_samples=4096, n_bootstrap=200, confidence_level=0.95, chunk_size=8192,
+                      seed=None):
+    for name in bounds:
+        if name not in sobol_parameter:
+            raise ValueError(f"Unbekannter Parameter '{name}', möglich sind {list(sobol_parameter)}.")
+    if output not in ('hu', 'yu', 'Hu'):
+        raise ValueError("output muss 'hu', 'Hu' oder 'yu' sein.")
+
+    Q = np.atleast_1d(labyrinth_object.Q if discharge_vector is None else np.asarray(discharge_vector, dtype=float))
+    UW = np.broadcast_to(labyrinth_object.UW if downstream_water_level_vector is None
+                         else np.asarray(downstream_water_level_vector, dtype=float), Q.shape)
+
+    namen = list(bounds)
+    k = len(namen)
+    untere = np.array([bounds[name][0] for name in namen], dtype=float)
+    obere = np.array([bounds[name][1] for name in namen], dtype=float)
+
+    nominal = {'labyrinth_length': labyrinth_object.B, 'labyrinth_key_angle': labyrinth_object.alpha,
+               'D': labyrinth_object.D, 't': labyrinth_object.t, 'labyrinth_height': labyrinth_object.P,
+               'labyrinth_width': labyrinth_object.W}
+
+    def modell(X):
+        eingabe = dict(nominal)
+        for i, name in enumerate(namen):
+            eingabe[sobol_parameter[name]] = X[:, i, None]
+        return labyrinth_batch(labyrinth_object.Sh, UW, Q, **eingabe)[output]
+
+    # Die Sobol-Folge ist nur für Blockgrößen mit Zweierpotenz ausgeglichen
+    chunk_size = 2 ** int(np.log2(chunk_size))
+    sampler = qmc.Sobol(d=2 * k, scramble=True, seed=seed)
+
+    fA = np.empty((n_samples, Q.size))
+    fB = np.empty((n_samples, Q.size))
+    fAB = np.empty((k, n_samples, Q.size))
+
+    for start in range(0, n_samples, chunk_size):
+        stop = min(start + chunk_size, n_samples)
+        X = untere + sampler.random(stop - start).reshape(-1, 2, k) * (obere - untere)
+        A, B = X[:, 0], X[:, 1]
+
+        fA[start:stop] = modell(A)
+        fB[start:stop] = modell(B)
+        for i in range(k):
+            AB = A.copy()
+            AB[:, i] = B[:, i]
+            fAB[i, start:stop] = modell(AB)
+
+    def indizes(fA, fB, fAB):
+        # Zentrieren verringert die Varianz des Schätzers erster Ordnung erheblich
+        mittel = np.mean(np.concatenate((fA, fB), axis=-2), axis=-2, keepdims=True)
+        fA, fB, fAB = fA - mittel, fB - mittel, fAB - mittel
+        var = np.var(np.concatenate((fA, fB), axis=-2), axis=-2)
+        S1 = np.mean(fB * (fAB - fA), axis=-2) / var
+        ST = 0.5 * np.mean(np.power(fA - fAB, 2), axis=-2) / var
+        return S1, ST
+
+    S1, ST = indizes(fA, fB, fAB)
+
+    # Bootstrap, die Stichproben werden einzeln gezogen um den Speicherbedarf zu begrenzen
+    rng = np.random.default_rng(seed)
+    S1_boot = np.empty((n_bootstrap,) + S1.shape)
+    ST_boot = np.empty((n_bootstrap,) + ST.shape)
+    for j in range(n_bootstrap):
+        idx = rng.integers(0, n_samples, n_samples)
+        S1_boot[j], ST_boot[j] = indizes(fA[idx], fB[idx], fAB[:, idx])
+
+    grenzen = 100 * np.array([(1 - confidence_level) / 2, (1 + confidence_level) / 2])
+    S1_ci = np.nanpercentile(S1_boot, grenzen, axis=0)
+    ST_ci = np.nanpercentile(ST_boot, grenzen, axis=0)
+
+    index = pd.MultiIndex.from_product([Q, namen], names=['Abfluss', 'Parameter'])
+    ergebnis = pd.DataFrame({'S1': S1.T.ravel(), 'S1 unten': S1_ci[0].T.ravel(), 'S1 oben': S1_ci[1].T.ravel(),
+                             'ST': ST.T.ravel(), 'ST unten': ST_ci[0].T.ravel(), 'ST oben': ST_ci[1].T.ravel()},
+                            index=index)
+
+    return ergebnis
+
+
+# Parameter des Ersatzmodells und zugehörige Eingaben von labyrinth_batch
+surrogate_parameter = {'B': 'labyrinth_length', 'alpha': 'labyrinth_key_angle', 'D': 'D', 'P': 'labyrinth_height',
+                       'W': 'labyrinth_width', 'Q': 'discharge', 'UW': 'downstream_water_level'}
+
+
+# Ersatzmodell (Response Surface) für hu bzw. yu des Labyrinth-Wehrs für schnelle Variantenstudien.
+# bounds: Wertebereiche der variierten Parameter (Schlüssel aus surrogate_parameter), z.B.
+# {'B': (3, 8), 'alpha': (6, 35), 'D': (0.2, 0.6), 'P': (1.8, 2.6), 'Q': (5, 40)}, alle anderen Parameter werden
+# aus labyrinth_object übernommen. Die Stützstellen sind eine Sobol-Folge, berechnet mit labyrinth_batch
+# (identisch mit Labyrinth(...).update()).
+# B, D und alpha gehen über die Wandlänge L ein (L springt mit der Anzahl der Keys, hu ist in L aber glatt).
+# Interpoliert wird log(hu) - 2/3 log(Q/L) über log(Q/L), log(L), alpha, P, W und UW mit einer radialen
+# Basisfunktion (scipy.interpolate.RBFInterpolator).
+# Fehlerschranke: maximaler Fehler gegenüber der exakten Lösung an n_validation unabhängigen Zufallspunkten
+# (error_bound, dazu rmse und das 99%-Quantil error_p99). Neue Stützstellen (add_samples) werden erst bei der
+# nächsten Abfrage eingearbeitet. Außerhalb von bounds liefert das Modell np.nan.
+class LabyrinthSurrogate():
+
+    def __init__(self, labyrinth_object=None, bounds=None, output='yu', n_samples=1024, n_validation=4096,
+                 kernel='cubic', seed=None):
+        if output not in ('hu', 'yu'):
+            raise ValueError("output muss 'hu' oder 'yu' sein.")
+        self.output = output
+        self.kernel = kernel
+        self.n_validation = n_validation
+        self.seed = seed
+        self._modell = None
+
+        if labyrinth_object is None:  # für load
+            return
+
+        for name in bounds:
+            if name not in surrogate_parameter:
+                raise ValueError(f"Unbekannter Parameter '{name}', möglich sind {list(surrogate_parameter)}.")
+
+        self.Sh = labyrinth_object.Sh
+        self.nominal = {'labyrinth_length': labyrinth_object.B, 'labyrinth_key_angle': labyrinth_object.alpha,
+                        'D': labyrinth_object.D, 'labyrinth_height': labyrinth_object.P,
+                        'labyrinth_width': labyrinth_object.W, 'discharge': labyrinth_object.Q,
+                        'downstream_water_level': labyrinth_object.UW}
+        self.namen = list(bounds)
+        self.untere = np.array([bounds[name][0] for name in self.namen], dtype=float)
+        self.obere = np.array([bounds[name][1] for name in self.namen], dtype=float)
+
+        self.X = np.empty((0, len(self.namen)))
+        self.hu = np.empty(0)
+        self._sampler = qmc.Sobol(d=len(self.namen), scramble=True, seed=seed)
+        self.add_samples(n_samples)
+
+    def eingabe(self, X):
+        eingabe = dict(self.nominal)
+        for i, name in enumerate(self.namen):
+            eingabe[surrogate_parameter[name]] = X[..., i]
+        return eingabe
+
+    def exakt(self, X):
+        return labyrinth_batch(self.Sh, **self.eingabe(X))['hu']
+
+    def merkmale(self, X):
+        e = {name: np.broadcast_to(np.asarray(wert, dtype=float), X.shape[:-1]) for name, wert in self.eingabe(X).items()}
+        L = labyrinth_geometry_batch(e['labyrinth_width'], e['labyrinth_length'], e['labyrinth_key_angle'], e['D'])['L']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            q = np.log(e['discharge'] / L)
+            M = np.stack((q, np.log(L), e['labyrinth_key_angle'], e['labyrinth_height'], e['labyrinth_width'],
+                          e['downstream_water_level']), axis=-1)
+        return M, q
+
+    # Neue Stützstellen aus der Sobol-Folge (n) oder vorgegebene Parameterkombinationen (X)
+    def add_samples(self, n=None, X=None):
+        if X is None:
+            X = self.untere + self._sampler.random(n) * (self.obere - self.untere)
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+
+        self.X = np.concatenate((self.X, X))
+        self.hu = np.concatenate((self.hu, self.exakt(X)))
+        self._modell = None
+
+    def fit(self):
+        gueltig = np.isfinite(self.hu) & (self.hu > 0)
+        M, q = self.merkmale(self.X[gueltig])
+
+        # konstante Merkmale (nicht variierte Parameter) entfallen
+        self._m_min = M.min(axis=0)
+        self._m_spanne = M.max(axis=0) - self._m_min
+        self._spalten = self._m_spanne > 0
+        y = np.log(self.hu[gueltig]) - (2 / 3) * q
+        self._modell = RBFInterpolator(self.normiert(M), y, kernel=self.kernel, degree=1)
+
+        # Validierung an unabhängigen Zufallspunkten
+        rng = np.random.default_rng(self.seed)
+        V = self.untere + rng.random((self.n_validation, len(self.namen))) * (self.obere - self.untere)
+        hu_exakt = self.exakt(V)
+        fehler = np.abs(self.predict(V, output='hu') - hu_exakt)
+        fehler = fehler[np.isfinite(hu_exakt) & (hu_exakt > 0)]
+        self.error_bound = np.max(fehler)
+        self.error_p99 = np.percentile(fehler, 99)
+        self.rmse = np.sqrt(np.mean(fehler * fehler))
+
+    def normiert(self, M):
+        return ((M - self._m_min) / np.where(self._spalten, self._m_spanne, 1))[..., self._spalten]
+
+    # X: (..., Anzahl Parameter) in der Reihenfolge von bounds
+    def predict(self, X, output=None):
+        if self._modell is None:
+            self.fit()
+
+        X = np.asarray(X, dtype=float)
+        if X.ndim == 1:
+            return self.punkt(X, output)
+
+        M, q = self.merkmale(X)
+        innerhalb = np.all((X >= self.untere) & (X <= self.obere), axis=-1)
+
+        flach = self.normiert(M).reshape(-1, int(np.sum(self._spalten)))
+        hu = np.exp(self._modell(flach).reshape(q.shape) + (2 / 3) * q)
+        hu = np.where(innerhalb, hu, np.nan)
+
+        if (output or self.output) == 'yu':
+            return self.Sh + self.eingabe(X)['labyrinth_height'] + hu
+        return hu
+
+    # Einzelne Parameterkombination ohne die Array-Verarbeitung von merkmale (L aus dem Zwischenspeicher von
+    # labyrinth_upstream_water_level), etwa 50 µs je Aufruf statt etwa 140 µs
+    def punkt(self, x, output=None):
+        if not np.all((x >= self.untere) & (x <= self.obere)):
+            return np.nan
+        e = self.eingabe(x)
+        L = _labyrinth_koeffizienten(float(e['labyrinth_width']), float(e['labyrinth_length']),
+                                     float(e['labyrinth_key_angle']), float(e['D']))[0]
+        q = math.log(e['discharge'] / L)
+        M = np.array([q, math.log(L), e['labyrinth_key_angle'], e['labyrinth_height'], e['labyrinth_width'],
+                      e['downstream_water_level']], dtype=float)
+        hu = math.exp(float(self._modell(self.normiert(M)[None, :])[0]) + (2 / 3) * q)
+
+        if (output or self.output) == 'yu':
+            return self.Sh + float(e['labyrinth_height']) + hu
+        return hu
+
+    # Abfrage mit Parameternamen, z.B. surrogate(B=5, alpha=10, Q=np.linspace(5, 40, 50))
+    def __call__(self, **parameter):
+        werte = [parameter.get(name, self.nominal[surrogate_parameter[name]]) for name in self.namen]
+        if all(np.ndim(wert) == 0 for wert in werte):
+            return self.predict(np.array(werte, dtype=float))
+        werte = np.broadcast_arrays(*(np.asarray(wert, dtype=float) for wert in werte))
+        return self.predict(np.stack(werte, axis=-1))
+
+    def save(self, path):
+        np.savez_compressed(path, X=self.X, hu=self.hu, namen=np.array(self.namen), untere=self.untere,
+                            obere=self.obere, Sh=self.Sh, nominal_namen=np.array(list(self.nominal)),
+                            nominal_werte=np.array(list(self.nominal.values()), dtype=float),
+                            output=self.output, kernel=self.kernel, n_validation=self.n_validation,
+                            seed=-1 if self.seed is None else self.seed, n_sobol=self._sampler.num_generated)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as daten:
+            seed = int(daten['seed'])
+            surrogate = cls(output=str(daten['output']), kernel=str(daten['kernel']),
+                            n_validation=int(daten['n_validation']), seed=None if seed < 0 else seed)
+            surrogate.Sh = float(daten['Sh'])
+            surrogate.nominal = dict(zip(daten['nominal_namen'].tolist(), daten['nominal_werte'].tolist()))
+            surrogate.namen = daten['namen'].tolist()
+            surrogate.untere = daten['untere']
+            surrogate.obere = daten['obere']
+            surrogate.X = daten['X']
+            surrogate.hu = daten['hu']
+            n_sobol = int(daten['n_sobol'])
+
+        # die Sobol-Folge wird an der gespeicherten Stelle fortgesetzt
+        surrogate._sampler = qmc.Sobol(d=len(surrogate.namen), scramble=True, seed=surrogate.seed)
+        surrogate._sampler.fast_forward(n_sobol)
+
+        return surrogate
+
+
 def tosbecken(Lab, Abfluss, Unterwasser, sicherheitsfaktor=25, Lab_Q=None, Kla=None, Kla_Q=None, Klappe_al=None):
     # plt.close()
 
@@ -1377,6 +3584,9 @@ def tosbecken(Lab, Abfluss, Unterwasser, sicherheitsfaktor=25, Lab_Q=None, Kla=N
         elif model == Kla:
             Q_UW = Kla_Q_UW
 
+        # Erdbeschleunigung: Labyrinth.gravity bzw. FlapGate.g
+        g = model.gravity if model == Lab else model.g
+
         delta_all_model = np.full(np.size(Abfluss), np.nan)
         y2_all_model = np.full(np.size(Abfluss), np.nan)
         hd_all_model = np.full(np.size(Abfluss), np.nan)
@@ -1404,12 +3614,12 @@ def tosbecken(Lab, Abfluss, Unterwasser, sicherheitsfaktor=25, Lab_Q=None, Kla=N
                 if y <= 0:  # Check if y is positive
                     return 1e6
                 v1 = Q / (model.W * y)
-                H1 = y + pow(v1, 2) / (2 * model.g)
+                H1 = y + pow(v1, 2) / (2 * g)
 
                 return abs(model.Hu - H1)  # negate H1 to maximize instead of minimize
 
             y0 = 0.00001  #
-            ymax = pow(pow(Q / model.W, 2) / model.g, (1 / 3))  # set maximum limit for y
+            ymax = pow(pow(Q / model.W, 2) / g, (1 / 3))  # set maximum limit for y
             bounds = [(None, ymax)]  # set the upper bound constraint
 
             result = minimize(f, y0, bounds=bounds)
@@ -1417,13 +3627,13 @@ def tosbecken(Lab, Abfluss, Unterwasser, sicherheitsfaktor=25, Lab_Q=None, Kla=N
 
             v1 = Q / (model.W * y1)
 
-            Fr1 = v1 / pow(model.g * y1, 0.5)
+            Fr1 = v1 / pow(g * y1, 0.5)
 
             y2 = 0.5 * y1 * (pow(1 + 8 * pow(Fr1, 2), 0.5) - 1)
 
             sicherheit_initial = 1 + sicherheitfaktor_initial / 100
 
-            delta = (sicherheit_initial * y2) - (model.UW - model.Sh) + (pow(Q / model.W, 2) / (model.g * 2)) * (
+            delta = (sicherheit_initial * y2) - (model.UW - model.Sh) + (pow(Q / model.W, 2) / (g * 2)) * (
                         (1 / pow(y2, 2)) - (1 / pow(model.UW - model.Sh, 2)))
 
             lange_tosbecken = 7 * (y2 - y1)  # Smetana
@@ -1432,7 +3642,7 @@ def tosbecken(Lab, Abfluss, Unterwasser, sicherheitsfaktor=25, Lab_Q=None, Kla=N
             delta_all_model[i] = delta
             y2_all_model[i] = y2
             hd_all_model[i] = model.UW - model.Sh
-            ymax_3_all_model[i] = pow(Q / model.W, 2) / (model.g * 2)
+            ymax_3_all_model[i] = pow(Q / model.W, 2) / (g * 2)
             lange_tosbecken_all_model[i] = lange_tosbecken
 
         delta_model[j] = np.nanmax(delta_all_model)
@@ -1459,6 +3669,157 @@ def tosbecken(Lab, Abfluss, Unterwasser, sicherheitsfaktor=25, Lab_Q=None, Kla=N
     return delta_design, lange_tosbecken_design
 
 
+# Körpermaße der Fischarten nach DWA (Länge, Höhe, Dicke) [m]
+fish_arten_DWA = {
+    "Bachforelle": (0.5, 0.10, 0.05),
+    "Äsche": (0.5, 0.10, 0.05),
+    "Huchen": (1.0, 0.16, 0.12),
+    "Seeforelle": (1.0, 0.21, 0.12),
+    "Perlfisch": (0.7, 0.13, 0.07),
+    "Döbel": (0.6, 0.16, 0.10),
+    "Lachs": (1.0, 0.17, 0.10),
+    "Meerforelle": (0.8, 0.17, 0.09),
+    "Quappe": (0.6, 0.11, 0.11),
+    "Plötze": (0.4, 0.13, 0.06),
+    "Barbe": (0.7, 0.13, 0.08),
+    "Nase": (0.6, 0.15, 0.09),
+    "Zährte": (0.5, 0.13, 0.06),
+    "Sterlet": (0.9, 0.15, 0.11),
+    "Aland": (0.6, 0.18, 0.09),
+    "Brachsen": (0.6, 0.21, 0.06),
+    "Rapfen": (0.7, 0.15, 0.07),
+    "Barsch": (0.4, 0.12, 0.07),
+    "Hecht": (1.0, 0.14, 0.10),
+    "Zander": (0.8, 0.15, 0.10),
+    "Wels": (1.6, 0.26, 0.24),
+    "Maifisch": (0.8, 0.16, 0.08),
+    "Karpfen": (0.8, 0.24, 0.13),
+    "Karausche": (0.45, 0.14, 0.07),
+    "Schleie": (0.6, 0.16, 0.09),
+    "Stör": (3.0, 0.51, 0.36),
+    "Finte": (0.5, 0.10, 0.05),
+    "Schnäpel": (0.4, 0.08, 0.04)
+}
+
+# Minimale Bypassbreite nach Ebel (2016) [m]
+fish_arten_Ebel = {
+    "Aale": 0.30,
+    "Salmoníden": 0.45,
+    "Salmoniden": 0.42,
+    "Störe": 1.00,
+    "Neurıaugen": 0.30,
+    "Aland": 0.36,
+    "Äsche": 0.30,
+    "Bachforelle": 0.34,
+    "Barbe": 0.38,
+    "Brasse": 0.34,
+    "Döbel": 0.35,
+    "Elritze": 0.17,
+    "Flussbarsch": 0.30,
+    "Hasel": 0.24,
+    "Hecht": 0.34,
+    "Huchen": 0.42,
+    "Karpfen": 0.47,
+    "Nase": 0.31,
+    "Plötze": 0.26,
+    "Quappe": 0.40,
+    "Rapfen": 0.36,
+    "Ukelei": 0.21,
+    "Wels": 0.58,
+    "Zährte": 0.31,
+    "Zander": 0.39
+}
+
+
+# Kriterien der Fischauf- und -abstiegsprüfung (Reihenfolge wie in plot_check_FAA_FAbA)
+FAA_FAbA_kriterien = ['Beschleunigung', 'Klappenbreite Ebel', 'Klappenbreite DWA', 'Überfallhöhe',
+                      'Eintauchgeschwindigkeit', 'Wasserpolster', 'Einleitung', 'Fließgeschwindigkeit']
+
+
+# Kennwerte für die Fischauf- und -abstiegsprüfung für alle Abflüsse aus results (operational_model mit Klappe)
+def FAA_FAbA_kennwerte(Kla, results, Bemessungsgeschwindigkeit=None):
+    Q = results.iloc[:, 0].to_numpy(dtype=float)
+    UW = results.iloc[:, 1].to_numpy(dtype=float)
+    OW = results.iloc[:, 2].to_numpy(dtype=float)
+    Kla_Q = results.iloc[:, 4].to_numpy(dtype=float)
+    Klappe_al = results.iloc[:, -1].to_numpy(dtype=float)
+
+    kla = flap_gate_batch(Kla.Sh, UW, Kla_Q, Kla.KW, Kla.KP, Klappe_al, gravity=Kla.g)
+
+    delta_h = OW - UW
+    h_uw = UW - Kla.Sh
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kennwerte = pd.DataFrame({
+            'Abfluss': Q,
+            'Klappe Q': Kla_Q,
+            'Klappe winkel': Klappe_al,
+            'Klappe P': kla['P_neu'],
+            'Klappe hu': kla['hu'],
+            'Klappe hd': kla['hd'],
+            'Beschleunigung': kla['beschleunigung'],
+            'Fallhöhe': delta_h,
+            'Eintauchgeschwindigkeit': np.power(2 * 9.81 * delta_h, 0.5),
+            'h_uw': h_uw,
+            'Wasserpolster': np.maximum(delta_h * 0.25, 1.2),
+            'v_FAA': np.full(len(Q), np.nan if Bemessungsgeschwindigkeit is None else Bemessungsgeschwindigkeit),
+            'v_FAbA': Kla_Q / (h_uw * Kla.KW),
+        })
+
+    return kennwerte
+
+
+# Prüfung aller Kriterien für alle Fischarten und alle Abflüsse in einem Schritt (ohne Plot).
+# Rückgabe: Kennwerte und eine Matrix (Fischart x Kriterium) x Abfluss mit True/False,
+# <NA> wenn ein Kriterium für die Fischart nicht anwendbar ist (keine Daten in DWA bzw. Ebel).
+def check_FAA_FAbA(Kla, results, fish_names=None, Bemessungsgeschwindigkeit=None):
+    if fish_names is None:
+        fish_names = list(fish_arten_DWA) + [name for name in fish_arten_Ebel if name not in fish_arten_DWA]
+
+    kennwerte = FAA_FAbA_kennwerte(Kla, results, Bemessungsgeschwindigkeit)
+
+    # Anforderungen je Fischart, np.nan wenn die Art in der Quelle nicht verfügbar ist
+    fisch_hohe = np.array([fish_arten_DWA[name][1] if name in fish_arten_DWA else np.nan for name in fish_names])
+    fisch_dicke = np.array([fish_arten_DWA[name][2] if name in fish_arten_DWA else np.nan for name in fish_names])
+    min_bypass_breite = np.array([fish_arten_Ebel.get(name, np.nan) for name in fish_names])
+
+    n_fish = len(fish_names)
+    n_Q = len(kennwerte)
+
+    # ergebnis und anforderung als (Fischart, Kriterium, Abfluss), der Vergleich erfolgt in einem Schritt
+    ergebnis = np.empty((n_fish, len(FAA_FAbA_kriterien), n_Q))
+    anforderung = np.empty_like(ergebnis)
+
+    ergebnis[:, 0] = kennwerte['Beschleunigung'].to_numpy()
+    anforderung[:, 0] = 1.0
+    ergebnis[:, 1] = Kla.KW
+    anforderung[:, 1] = min_bypass_breite[:, None]
+    ergebnis[:, 2] = Kla.KW
+    anforderung[:, 2] = 9 * fisch_dicke[:, None]
+    ergebnis[:, 3] = kennwerte['Klappe hu'].to_numpy()
+    anforderung[:, 3] = 3 * fisch_hohe[:, None]
+    ergebnis[:, 4] = kennwerte['Eintauchgeschwindigkeit'].to_numpy()
+    anforderung[:, 4] = 8
+    ergebnis[:, 5] = kennwerte['h_uw'].to_numpy()
+    anforderung[:, 5] = kennwerte['Wasserpolster'].to_numpy()
+    ergebnis[:, 6] = kennwerte['h_uw'].to_numpy() + 0.5
+    anforderung[:, 6] = kennwerte['Klappe P'].to_numpy()
+    ergebnis[:, 7] = kennwerte['v_FAA'].to_numpy()
+    anforderung[:, 7] = kennwerte['v_FAbA'].to_numpy()
+
+    # Mindestwerte (ergebnis >= anforderung) bzw. Höchstwerte (ergebnis <= anforderung)
+    mindestwert = np.array([False, True, True, True, False, True, True, True])[None, :, None]
+    erfuellt = np.where(mindestwert, ergebnis >= anforderung, ergebnis <= anforderung)
+    anwendbar = np.isfinite(ergebnis) & np.isfinite(anforderung)
+
+    index = pd.MultiIndex.from_product([fish_names, FAA_FAbA_kriterien], names=['Fischart', 'Kriterium'])
+    columns = pd.Index(kennwerte['Abfluss'].to_numpy(), name='Abfluss')
+    matrix = pd.DataFrame(erfuellt.reshape(-1, n_Q), index=index, columns=columns).astype('boolean')
+    matrix = matrix.mask(~anwendbar.reshape(-1, n_Q))
+
+    return kennwerte, matrix
+
+
 def plot_check_FAA_FAbA(Kla, results, results_events, fish_name=None, Bemessungsgeschwindigkeit=None):
     def check_fish_availability(fish_name):
         # Initialize variables to None
@@ -1486,66 +3847,6 @@ def plot_check_FAA_FAbA(Kla, results, results_events, fish_name=None, Bemessungs
 
         return fisch_lange, fisch_hohe, fisch_dicke, min_bypass_breite
 
-    # Example dictionaries
-    fish_arten_DWA = {
-        "Bachforelle": (0.5, 0.10, 0.05),
-        "Äsche": (0.5, 0.10, 0.05),
-        "Huchen": (1.0, 0.16, 0.12),
-        "Seeforelle": (1.0, 0.21, 0.12),
-        "Perlfisch": (0.7, 0.13, 0.07),
-        "Döbel": (0.6, 0.16, 0.10),
-        "Lachs": (1.0, 0.17, 0.10),
-        "Meerforelle": (0.8, 0.17, 0.09),
-        "Quappe": (0.6, 0.11, 0.11),
-        "Plötze": (0.4, 0.13, 0.06),
-        "Barbe": (0.7, 0.13, 0.08),
-        "Nase": (0.6, 0.15, 0.09),
-        "Zährte": (0.5, 0.13, 0.06),
-        "Sterlet": (0.9, 0.15, 0.11),
-        "Aland": (0.6, 0.18, 0.09),
-        "Brachsen": (0.6, 0.21, 0.06),
-        "Rapfen": (0.7, 0.15, 0.07),
-        "Barsch": (0.4, 0.12, 0.07),
-        "Hecht": (1.0, 0.14, 0.10),
-        "Zander": (0.8, 0.15, 0.10),
-        "Wels": (1.6, 0.26, 0.24),
-        "Maifisch": (0.8, 0.16, 0.08),
-        "Karpfen": (0.8, 0.24, 0.13),
-        "Karausche": (0.45, 0.14, 0.07),
-        "Schleie": (0.6, 0.16, 0.09),
-        "Stör": (3.0, 0.51, 0.36),
-        "Finte": (0.5, 0.10, 0.05),
-        "Schnäpel": (0.4, 0.08, 0.04)
-    }
-
-    fish_arten_Ebel = {
-        "Aale": 0.30,
-        "Salmoníden": 0.45,
-        "Salmoniden": 0.42,
-        "Störe": 1.00,
-        "Neurıaugen": 0.30,
-        "Aland": 0.36,
-        "Äsche": 0.30,
-        "Bachforelle": 0.34,
-        "Barbe": 0.38,
-        "Brasse": 0.34,
-        "Döbel": 0.35,
-        "Elritze": 0.17,
-        "Flussbarsch": 0.30,
-        "Hasel": 0.24,
-        "Hecht": 0.34,
-        "Huchen": 0.42,
-        "Karpfen": 0.47,
-        "Nase": 0.31,
-        "Plötze": 0.26,
-        "Quappe": 0.40,
-        "Rapfen": 0.36,
-        "Ukelei": 0.21,
-        "Wels": 0.58,
-        "Zährte": 0.31,
-        "Zander": 0.39
-    }
-
     # Check if fish_name is in either fish_arten_DWA or fish_arten_Ebel
     if fish_name not in fish_arten_DWA and fish_name not in fish_arten_Ebel:
         print(f"Die gewählte Fischart '{fish_name}' ist in der DWA und Ebel(2016) Quelle nicht verfügbar.")
@@ -1557,26 +3858,14 @@ def plot_check_FAA_FAbA(Kla, results, results_events, fish_name=None, Bemessungs
     # fish_df_DWA = pd.DataFrame.from_dict(fish_arten_DWA, orient='index', columns=['Fisch Länge', 'Fisch Höhe', 'Fisch Dicke'])
     # fish_df_Ebel = pd.DataFrame.from_dict(fish_arten_Ebel, orient='index', columns=['Minimal bypass breite'])
 
-    Klappe_hu = np.zeros(len(results))
-    Klappe_hd = np.zeros(len(results))
-    Klappe_a = np.zeros(len(results))
-    Klappe_P = np.zeros(len(results))
-    delta_h = np.zeros(len(results))
-    v_FAA = np.full(len(results), Bemessungsgeschwindigkeit)
-    v_FAbA = np.zeros(len(results))
+    kennwerte = FAA_FAbA_kennwerte(Kla, results, Bemessungsgeschwindigkeit)
 
-    for i, (Q, UW, klappe_w) in enumerate(zip(results.iloc[:, 4], results.iloc[:, 1], results.iloc[:, -1])):
-        Kla.Q = Q
-        Kla.UW = UW
-        Kla.Kalpha = klappe_w
-        Kla.cal_P_neu()
-        Kla.update()
-        Klappe_P[i] = Kla.P_neu
-        Klappe_hu[i] = Kla.hu
-        Klappe_hd[i] = Kla.hd
-        Klappe_a[i] = Kla.beschleunigung
-        delta_h[i] = results.iloc[i, 2] - results.iloc[i, 1]
-        v_FAbA[i] = results.iloc[i, 4] / ((results.iloc[i, 1] - Kla.Sh) * Kla.KW)
+    Klappe_hu = kennwerte['Klappe hu'].to_numpy()
+    Klappe_a = kennwerte['Beschleunigung'].to_numpy()
+    Klappe_P = kennwerte['Klappe P'].to_numpy()
+    delta_h = kennwerte['Fallhöhe'].to_numpy()
+    v_FAA = kennwerte['v_FAA'].to_numpy()
+    v_FAbA = kennwerte['v_FAbA'].to_numpy()
 
     delta_h_wasserpolster = np.maximum(delta_h * 0.25, 1.2)
 
@@ -1771,3 +4060,131 @@ def write_flap_excel(flap):
         pd.DataFrame([row_numbers]).to_excel(writer, index=False, header=False, startrow=0)
         # Dann Spaltennamen + Werte
         df.to_excel(writer, index=False, startrow=1)
+
+
+# Ein Fall für main (eigene Funktion für den Prozesspool): Geometrieoptimierung, Betriebsmodell (nur mit
+# Hydrologie-Datei) und Tosbecken. Fehler landen in der Spalte 'Fehler', Bildschirmausgaben in 'Meldungen',
+# beides bricht die übrigen Fälle nicht ab. profile: Datei für die cProfile-Statistik dieses Falls.
+def _batch_fall(fall, profile=None):
+    def wert(name, standard=None):
+        x = fall.get(name)
+        return standard if x is None or (isinstance(x, float) and math.isnan(x)) else x
+
+    ergebnis = {'name': wert('name')}
+    start = time.perf_counter()
+    profiler = cProfile.Profile() if profile else None
+    if profiler:
+        profiler.enable()
+
+    with contextlib.redirect_stdout(io.StringIO()) as ausgabe:
+        try:
+            Lab = optimize_labyrinth_geometry(Labyrinth, wert('bottom_level'), wert('design_downstream_water_level'),
+                                              wert('design_discharge'), wert('labyrinth_width'),
+                                              wert('labyrinth_height'), wert('labyrinth_length'), '',
+                                              D_vector=wert('D'))
+            if Lab is None:
+                raise ValueError('Keine zulässige Geometrie gefunden.')
+            ergebnis.update({'B': Lab.B, 'alpha': Lab.alpha, 'D': Lab.D, 'N': Lab.N, 'L': Lab.L, 'Hu': Lab.Hu,
+                             'OW Bemessung': Lab.yu})
+
+            if wert('hydrology') is not None:
+                hydrologie = pd.read_csv(wert('hydrology'), sep=None, engine='python')
+                Abfluss, Unterwasser, Oberwasser = (hydrologie.iloc[:, k].to_numpy(dtype=float) for k in range(3))
+
+                Kla = None
+                if wert('flap_gate_width') is not None:
+                    Kla = FlapGate(wert('bottom_level'), Unterwasser[-1], Abfluss[-1], wert('flap_gate_width'),
+                                   wert('flap_gate_height'), wert('max_flap_gate_angle'))
+
+                betrieb = operational_model(Lab, Abfluss, Unterwasser, Oberwasser,
+                                            wert('interpolation_method', 'exponential'),
+                                            interpolation_stepsize=wert('interpolation_stepsize', 1),
+                                            flap_gate_opject=Kla,
+                                            design_upstream_water_level=wert('design_upstream_water_level'),
+                                            max_flap_gate_angle=wert('max_flap_gate_angle'), write_files=False)
+                if isinstance(betrieb, list):
+                    raise ValueError(' '.join(betrieb))
+                results, results_events = betrieb
+                ergebnis.update({'OW max': results['OW'].max(), 'OW Ereignisse max': results_events['OW'].max()})
+
+                if Kla is None:
+                    tosbecken_werte = tosbecken(Lab, results['Abfluss'].to_numpy(), results['UW'].to_numpy())
+                else:
+                    ergebnis['Klappe winkel max'] = results['Klappe winkel'].max()
+                    tosbecken_werte = tosbecken(Lab, results['Abfluss'].to_numpy(), results['UW'].to_numpy(),
+                                                Lab_Q=results['Labyrinth Q'].to_numpy(), Kla=Kla,
+                                                Kla_Q=results['Klappe Q'].to_numpy(),
+                                                Klappe_al=results['Klappe winkel'])
+                ergebnis['Tosbecken Eintiefung'], ergebnis['Tosbecken Länge'] = tosbecken_werte
+
+        except (Exception, SystemExit) as fehler:
+            ergebnis['Fehler'] = f"{type(fehler).__name__}: {fehler}".rstrip(': ')
+
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(profile)
+
+    ergebnis['Meldungen'] = ausgabe.getvalue().strip()
+    ergebnis['Laufzeit [s]'] = time.perf_counter() - start
+
+    return ergebnis
+
+
+# Kommandozeile für Stapelrechnungen, z.B. für die nächtliche Neuberechnung aller Standorte:
+#   python engineer.py cases.csv -o results.csv --jobs 4 --profile
+# Die Falltabelle (CSV oder Parquet) hat je Fall eine Zeile mit den Spalten name, bottom_level, labyrinth_width,
+# labyrinth_height, labyrinth_length (maximale Länge), design_discharge, design_downstream_water_level und
+# optional D, hydrology (CSV mit Kopfzeile, Abfluss, Unterwasser und heutiger Oberwasserstand in den ersten
+# drei Spalten, Pfad relativ zur Falltabelle), interpolation_method, interpolation_stepsize, flap_gate_width,
+# flap_gate_height, design_upstream_water_level und max_flap_gate_angle (mit Klappe).
+# Ergebnis ist eine Tabelle mit einer Zeile je Fall (.parquet oder CSV mit ;).
+# --profile schreibt die cProfile-Statistik aller Fälle nach <output>.prof und zeigt die teuersten Funktionen.
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='engineer', description='Stapelrechnung für Labyrinth-Wehre: '
+                                     'Geometrieoptimierung, Betriebsmodell und Tosbecken je Fall.')
+    parser.add_argument('cases', help='Falltabelle (.csv oder .parquet)')
+    parser.add_argument('-o', '--output', default='results.csv', help='Ergebnistabelle (.csv oder .parquet)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Anzahl paralleler Prozesse (Standard: 1)')
+    parser.add_argument('--profile', action='store_true', help='cProfile-Statistik nach <output>.prof schreiben')
+    args = parser.parse_args(argv)
+
+    if args.cases.lower().endswith('.parquet'):
+        faelle = pd.read_parquet(args.cases)
+    else:
+        faelle = pd.read_csv(args.cases, sep=None, engine='python')
+
+    basis = os.path.dirname(os.path.abspath(args.cases))
+    faelle = faelle.to_dict('records')
+    for k, fall in enumerate(faelle):
+        fall.setdefault('name', k)
+        if isinstance(fall.get('hydrology'), str):
+            fall['hydrology'] = os.path.join(basis, fall['hydrology'])
+    profile = [f'{args.output}.{k}.prof' if args.profile else None for k in range(len(faelle))]
+
+    if args.jobs > 1:
+        with ProcessPoolExecutor(args.jobs) as pool:
+            zeilen = list(pool.map(_batch_fall, faelle, profile))
+    else:
+        zeilen = [_batch_fall(fall, datei) for fall, datei in zip(faelle, profile)]
+
+    tabelle = pd.DataFrame(zeilen)
+    if args.output.lower().endswith('.parquet'):
+        tabelle.to_parquet(args.output, index=False)
+    else:
+        tabelle.to_csv(args.output, sep=';', index=False)
+
+    n_fehler = int(tabelle['Fehler'].notna().sum()) if 'Fehler' in tabelle else 0
+    print(f"{len(tabelle)} Fälle berechnet, {n_fehler} mit Fehler. Ergebnis: {args.output}")
+
+    if args.profile and profile:
+        statistik = pstats.Stats(*profile)
+        statistik.dump_stats(args.output + '.prof')
+        for datei in profile:
+            os.remove(datei)
+        statistik.sort_stats('cumulative').print_stats(20)
+
+    return tabelle
+
+
+if __name__ == '__main__':
+    main()